@@ -1,21 +1,167 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_from_directory, abort, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, abort, jsonify, g, Response, stream_with_context
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+import base64
+import json
+import mimetypes
+import re
+import secrets
+import shutil
 import sqlite3
+import tempfile
+import threading
+import time
+import click
 from functools import wraps
-from datetime import datetime
+from urllib.parse import quote
+from db import READ_PRAGMAS, ConnectionPool, Replica, migrate, pending_migrations, rebuild_student_counts
+from cache import MISSING, MemoryBackend, SQLiteBackend, ScopedCache, scope_key
+from authz import ScopeAuthorizer
+from storage import BlobStore, blob_digest, matches_magic, file_sha256
+from jobs import WorkerPool, enqueue, queue_stats, requeue_stale
+from thumbnails import generate_thumbnail, needs_thumbnail, thumbnail_format, thumbnail_path
+from catalog import Catalog, add_departments
+from passwords import PasswordPolicy
+from sessions import MemorySessionStore, SQLiteSessionStore, ServerSideSessionInterface
+from metrics import InstrumentedConnection, Metrics, SamplingProfiler, stats_gauges
+from maintenance import TASKS as MAINTENANCE_TASKS, MaintenanceScheduler, maintenance_status, run_step, run_task
+from archive import iter_csv, iter_file, stream_zip, zip_date_time
+from importer import STUDENT_FIELDS, ImportFormatError, detect_format, read_records, clean_records, import_students
+import queries
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+app.config['DATABASE'] = 'database.db'
+# Migrate (and seed) an out-of-date database at the first request. Turn it
+# off where deployments run `flask migrate` before starting the workers.
+app.config['AUTO_MIGRATE'] = True
+app.config['DB_POOL_SIZE'] = 5
+app.config['DB_POOL_TIMEOUT'] = 10.0  # seconds to wait for a free connection
+app.config['DB_BUSY_TIMEOUT'] = 5000  # milliseconds SQLite waits on a locked database
+# Routes marked with @stale_reads (the exports) read from a separate pool of
+# read-only connections, or from replica files copied from DATABASE every
+# REPLICA_REFRESH_INTERVAL seconds (0 leaves that to `flask refresh-replicas`).
+# A replica further than REPLICA_MAX_LAG seconds behind is not used, nor is
+# one for a user who wrote something within that time.
+# Cached counts are always computed from the primary, see read_primary().
+app.config['DB_READ_POOL_SIZE'] = 5
+app.config['DATABASE_REPLICAS'] = []  # e.g. ['replica.db']
+app.config['REPLICA_REFRESH_INTERVAL'] = 5.0
+app.config['REPLICA_MAX_LAG'] = 10.0
+# Hash method for new and rehashed passwords, e.g. 'pbkdf2:sha256:600000'.
+# Existing hashes are upgraded transparently at the next successful login.
+app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:260000'
+app.config['PASSWORD_SALT_LENGTH'] = 16
+app.config['USER_CACHE_SIZE'] = 1024
+app.config['USER_CACHE_TTL'] = 300  # seconds
+# Sessions are kept server-side and the cookie only holds their ID. 'sqlite'
+# shares them between the workers on a host, 'memory' suits a single process.
+app.config['SESSION_BACKEND'] = 'sqlite'
+app.config['SESSION_DB_PATH'] = 'sessions.db'
+app.config['SESSION_MEMORY_SIZE'] = 10000
+app.config['SESSION_LOCAL_CACHE_SIZE'] = 1024
+app.config['SESSION_LOCAL_TTL'] = 5.0  # seconds a worker reuses a session read from SESSION_DB_PATH
+app.config['SESSION_SWEEP_INTERVAL'] = 300  # seconds between deletes of expired sessions
+app.config['PERMANENT_SESSION_LIFETIME'] = 12 * 60 * 60  # seconds a session lives after its last change
+app.config['STATS_CACHE_TTL'] = 30  # seconds
+app.config['STATS_CACHE_SIZE'] = 256
+app.config['STATS_CACHE_BACKEND'] = 'memory'  # or 'sqlite' to share between workers
+app.config['STATS_CACHE_PATH'] = 'cache.db'
+app.config['IMPORT_BATCH_SIZE'] = 500
+app.config['STUDENTS_PAGE_SIZE'] = 50
+app.config['STUDENTS_MAX_PAGE_SIZE'] = 500
+app.config['SEARCH_MAX_RESULTS'] = 50
+app.config['AUTHZ_CACHE_SIZE'] = 4096
+app.config['AUTHZ_FILE_TTL'] = 30  # seconds a file's cached owners are trusted
+app.config['CATALOG_CHECK_INTERVAL'] = 5.0  # seconds between checks for catalog edits by other workers
+# How authorized uploads are sent: 'internal' streams them from this process,
+# 'x-accel-redirect' (nginx) and 'x-sendfile' (Apache, lighttpd) hand the
+# transfer to the front-end server once the permission check has passed.
+app.config['UPLOAD_SERVE_MODE'] = 'internal'
+app.config['UPLOAD_X_ACCEL_PREFIX'] = '/protected-uploads/'  # nginx internal location aliased to UPLOAD_FOLDER
+app.config['UPLOAD_MAX_AGE'] = 24 * 60 * 60  # seconds browsers may reuse a file before revalidating
+app.config['UPLOAD_IMMUTABLE_MAX_AGE'] = 365 * 24 * 60 * 60  # content-addressed files never change
+app.config['THUMBNAIL_SIZE'] = (320, 320)
+app.config['THUMBNAIL_FORMAT'] = 'WEBP'  # falls back to JPEG if Pillow lacks WebP support
+app.config['JOB_WORKERS'] = 2  # background threads per process; 0 leaves jobs to `flask run-jobs`
+app.config['JOB_POLL_INTERVAL'] = 5.0
+# Resumable uploads (/api/uploads) send the file in chunks of at most
+# MAX_CONTENT_LENGTH bytes each, so the total can be larger
+app.config['MAX_UPLOAD_SIZE'] = 200 * 1024 * 1024
+app.config['UPLOAD_CHUNK_SIZE'] = 8 * 1024 * 1024  # suggested to clients
+app.config['EXPORT_BATCH_SIZE'] = 500  # rows read per query while streaming an export
+# Maintenance tasks (see maintenance.py) are queued as background jobs every
+# MAINTENANCE_INTERVALS seconds, by a scheduler thread in each web process if
+# MAINTENANCE_SCHEDULER is set or by `flask maintenance schedule`. Long tasks
+# work in steps of MAINTENANCE_BATCH_SIZE rows or files, MAINTENANCE_THROTTLE
+# seconds apart.
+app.config['MAINTENANCE_SCHEDULER'] = False
+app.config['MAINTENANCE_INTERVALS'] = {
+    'optimize': 60 * 60,
+    'cleanup_uploads': 60 * 60,
+    'analyze': 24 * 60 * 60,
+    'vacuum': 24 * 60 * 60,
+    'reconcile_blobs': 24 * 60 * 60,
+    'gc_uploads': 24 * 60 * 60,
+    'check_references': 7 * 24 * 60 * 60,
+    'integrity_check': 7 * 24 * 60 * 60,
+    'prune_changes': 24 * 60 * 60,
+    'prune_jobs': 24 * 60 * 60,
+}
+app.config['MAINTENANCE_BATCH_SIZE'] = 200
+app.config['MAINTENANCE_THROTTLE'] = 1.0
+app.config['ORPHAN_GRACE_PERIOD'] = 60 * 60  # seconds before an unreferenced upload may be deleted
+app.config['UPLOAD_SESSION_TTL'] = 24 * 60 * 60  # seconds an idle resumable upload is kept
+app.config['ANALYSIS_LIMIT'] = 1000  # rows ANALYZE samples per index
+app.config['VACUUM_PAGES'] = 1000  # free pages returned per incremental vacuum step
+app.config['MAINTENANCE_FIX_DANGLING'] = False  # delete documents rows whose file is missing
+app.config['JOB_RETENTION'] = 7 * 24 * 60 * 60  # seconds finished and failed jobs are kept
+# Opt-in instrumentation: per-endpoint latency and SQL statistics served at
+# /metrics in the Prometheus text format. The sampling profiler additionally
+# writes folded stacks (for flamegraph.pl or speedscope) of slow requests.
+app.config['METRICS_ENABLED'] = False
+app.config['METRICS_SLOW_QUERY_MS'] = 100
+app.config['PROFILER_ENABLED'] = False
+app.config['PROFILER_DIR'] = 'profiles'
+app.config['PROFILER_INTERVAL'] = 0.005  # seconds between stack samples
+app.config['PROFILER_THRESHOLD_MS'] = 500  # requests slower than this are dumped
+app.config['PROFILER_KEEP'] = 20  # the slowest dumps kept in PROFILER_DIR
+# /api/changes pages, long-poll and server-sent events. Consumers that fall
+# more than CHANGES_RETENTION seconds behind have to resync.
+app.config['CHANGES_PAGE_SIZE'] = 500
+app.config['CHANGES_MAX_PAGE_SIZE'] = 5000
+app.config['CHANGES_MAX_WAIT'] = 30  # seconds a long poll may wait
+app.config['CHANGES_POLL_INTERVAL'] = 1.0  # seconds between checks for new changes
+app.config['CHANGES_HEARTBEAT'] = 15  # seconds between keep-alive comments on an event stream
+app.config['CHANGES_STREAM_MAX_AGE'] = 300  # seconds before an event stream ends and the client reconnects
+app.config['CHANGES_RETENTION'] = 30 * 24 * 60 * 60
+# Serving through asgi.py: views run in ASGI_THREADS threads per process
+# (keep DB_POOL_SIZE in step) and request bodies past ASGI_SPOOL_SIZE bytes
+# are spooled to a temporary file while they arrive
+app.config['ASGI_THREADS'] = 16
+app.config['ASGI_SPOOL_SIZE'] = 1024 * 1024
+# Deployment settings, e.g. DATABASE or AUTO_MIGRATE, from the Python file
+# named by STUDENT_MGMT_SETTINGS. Read here, on import, because the `flask`
+# CLI uses this app without calling create_app().
+app.config.from_envvar('STUDENT_MGMT_SETTINGS', silent=True)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'doc', 'docx'}
 
-# Database initialization
-def init_db():
-    conn = sqlite3.connect('database.db')
+def get_password_policy():
+    policy = app.extensions.get('password_policy')
+    if policy is None:
+        policy = PasswordPolicy(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_SALT_LENGTH'])
+        app.extensions['password_policy'] = policy
+    return policy
+
+# Database initialization. Nothing here runs on import: `flask migrate` and
+# `flask seed` (or the first request, with AUTO_MIGRATE) do it once, so a
+# worker starts without touching the database.
+def migrate_db():
+    conn = sqlite3.connect(app.config['DATABASE'])
     cursor = conn.cursor()
     
     # Create tables if they don't exist
@@ -55,25 +201,45 @@ def init_db():
         )
     ''')
     
-    # Insert default admin accounts if they don't exist
+    conn.commit()
+    applied = migrate(conn)
+    conn.close()
+    return applied
+
+def seed_db():
+    conn = sqlite3.connect(app.config['DATABASE'])
+    cursor = conn.cursor()
+    
+    # Insert default admin accounts if they don't exist. Hashing is the slow
+    # part, so only accounts that are actually missing get hashed.
     default_users = [
-        ('superadmin', generate_password_hash('superadmin123'), 'super_admin', None, None),
-        ('eng_admin', generate_password_hash('admin123'), 'school', 'Engineering', None),
-        ('arts_admin', generate_password_hash('admin123'), 'school', 'Arts', None),
-        ('cse_admin', generate_password_hash('admin123'), 'department', 'Engineering', 'CSE'),
-        ('eee_admin', generate_password_hash('admin123'), 'department', 'Engineering', 'EEE'),
-        ('mech_admin', generate_password_hash('admin123'), 'department', 'Engineering', 'Mech'),
-        ('bsc_admin', generate_password_hash('admin123'), 'department', 'Arts', 'B.Sc (CS)'),
-        ('bca_admin', generate_password_hash('admin123'), 'department', 'Arts', 'BCA'),
-        ('bcom_admin', generate_password_hash('admin123'), 'department', 'Arts', 'B.Com'),
-        ('econ_admin', generate_password_hash('admin123'), 'department', 'Arts', 'Economics')
+        ('superadmin', 'superadmin123', 'super_admin', None, None),
+        ('eng_admin', 'admin123', 'school', 'Engineering', None),
+        ('arts_admin', 'admin123', 'school', 'Arts', None),
+        ('cse_admin', 'admin123', 'department', 'Engineering', 'CSE'),
+        ('eee_admin', 'admin123', 'department', 'Engineering', 'EEE'),
+        ('mech_admin', 'admin123', 'department', 'Engineering', 'Mech'),
+        ('bsc_admin', 'admin123', 'department', 'Arts', 'B.Sc (CS)'),
+        ('bca_admin', 'admin123', 'department', 'Arts', 'BCA'),
+        ('bcom_admin', 'admin123', 'department', 'Arts', 'B.Com'),
+        ('econ_admin', 'admin123', 'department', 'Arts', 'Economics')
     ]
     
-    for user in default_users:
-        try:
-            cursor.execute('INSERT INTO users (username, password, role, school, department) VALUES (?, ?, ?, ?, ?)', user)
-        except sqlite3.IntegrityError:
-            pass
+    existing = {row[0] for row in cursor.execute('SELECT username FROM users')}
+    policy = get_password_policy()
+    missing = [(username, policy.hash(password), role, school, department)
+               for username, password, role, school, department in default_users if username not in existing]
+    
+    # Under the write lock, so that processes seeding side by side neither
+    # fail on nor duplicate each other's rows
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.executemany('INSERT OR IGNORE INTO users (username, password, role, school, department) '
+                       'VALUES (?, ?, ?, ?, ?)', missing)
+    
+    # The migration that created the catalog filled it from the students
+    # that existed then, which on a fresh database is none; the default
+    # admins' departments have to be in it for them to add or import anyone
+    add_departments(conn, [(school, department) for _, _, _, school, department in default_users if department])
     
     # Insert sample students if none exist
     if cursor.execute('SELECT COUNT(*) FROM students').fetchone()[0] == 0:
@@ -93,18 +259,400 @@ def init_db():
     
     conn.commit()
     conn.close()
+    return len(missing)
 
-init_db()
+def init_db():
+    migrate_db()
+    seed_db()
+
+_schema_lock = threading.Lock()
+
+@app.before_request
+def ensure_schema():
+    # Checked once per process, at its first request instead of on import.
+    # A database behind the code, or one without accounts yet, is migrated
+    # and seeded here if AUTO_MIGRATE is set; otherwise `flask migrate` and
+    # `flask seed` have to be run first. The job workers start here too.
+    if app.extensions.get('schema_checked'):
+        return
+    with _schema_lock:
+        if app.extensions.get('schema_checked'):
+            return
+        conn = sqlite3.connect(app.config['DATABASE'])
+        try:
+            pending = pending_migrations(conn)
+            seeded = not pending and conn.execute('SELECT EXISTS (SELECT 1 FROM users)').fetchone()[0]
+        finally:
+            conn.close()
+        if not seeded:
+            if not app.config['AUTO_MIGRATE']:
+                raise RuntimeError(f'Database schema is {len(pending)} migration(s) behind or has no accounts, '
+                                   f'run `flask migrate` and `flask seed`')
+            init_db()
+        start_job_workers()
+        app.extensions['schema_checked'] = True
+
+def close_resources():
+    # Stops the background threads and closes the pools and stores opened
+    # through the get_*() accessors, and forgets the schema check, so the
+    # next request opens everything again from the current config
+    workers = app.extensions.get('job_workers')
+    if workers is not None:
+        workers.stop()
+    scheduler = app.extensions.get('maintenance_scheduler')
+    if scheduler is not None:
+        scheduler.stop()
+    for replica in app.extensions.get('db_replicas') or []:
+        replica.close()
+    for name in ('db_pool', 'db_read_pool'):
+        pool = app.extensions.get(name)
+        if pool is not None:
+            pool.close_all()
+    store = app.extensions.get('session_store')
+    if store is not None:
+        store.close()
+    app.session_interface.stop()
+    for name in ('authorizer', 'blob_store', 'catalog', 'db_pool', 'db_read_pool', 'db_replicas',
+                 'job_workers', 'maintenance_scheduler', 'metrics', 'password_policy', 'profiler',
+                 'schema_checked', 'session_store', 'stats_cache', 'user_cache'):
+        app.extensions.pop(name, None)
+
+def create_app(config=None):
+    # Entry point for servers and tests, e.g. gunicorn 'app:create_app()'.
+    # Routes are registered on the module-level app, so each call applies
+    # configuration, from the file named by STUDENT_MGMT_SETTINGS and then
+    # from config, to that app and drops whatever an earlier call opened;
+    # the database, pools and caches are opened again by the first request
+    # that needs them.
+    close_resources()
+    app.config.from_envvar('STUDENT_MGMT_SETTINGS', silent=True)
+    if config:
+        app.config.update(config)
+    app.session_interface = ServerSideSessionInterface(get_session_store,
+                                                       sweep_interval=app.config['SESSION_SWEEP_INTERVAL'])
+    return app
 
 # Helper functions
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def get_pool():
+    pool = app.extensions.get('db_pool')
+    if pool is None:
+        pool = ConnectionPool(app.config['DATABASE'],
+                              size=app.config['DB_POOL_SIZE'],
+                              timeout=app.config['DB_POOL_TIMEOUT'],
+                              busy_timeout=app.config['DB_BUSY_TIMEOUT'])
+        app.extensions['db_pool'] = pool
+    return pool
+
+def get_read_pool():
+    pool = app.extensions.get('db_read_pool')
+    if pool is None:
+        pool = ConnectionPool(app.config['DATABASE'],
+                              size=app.config['DB_READ_POOL_SIZE'],
+                              timeout=app.config['DB_POOL_TIMEOUT'],
+                              busy_timeout=app.config['DB_BUSY_TIMEOUT'],
+                              pragmas=READ_PRAGMAS)
+        app.extensions['db_read_pool'] = pool
+    return pool
+
+def get_replicas():
+    replicas = app.extensions.get('db_replicas')
+    if replicas is None:
+        replicas = [Replica(app.config['DATABASE'], path,
+                            interval=app.config['REPLICA_REFRESH_INTERVAL'],
+                            pool_size=app.config['DB_READ_POOL_SIZE'],
+                            busy_timeout=app.config['DB_BUSY_TIMEOUT'])
+                    for path in app.config['DATABASE_REPLICAS']]
+        for replica in replicas:
+            replica.start()
+        app.extensions['db_replicas'] = replicas
+    return replicas
+
+def get_stats_cache():
+    cache = app.extensions.get('stats_cache')
+    if cache is None:
+        if app.config['STATS_CACHE_BACKEND'] == 'sqlite':
+            backend = SQLiteBackend(app.config['STATS_CACHE_PATH'], maxsize=app.config['STATS_CACHE_SIZE'])
+        else:
+            backend = MemoryBackend(maxsize=app.config['STATS_CACHE_SIZE'])
+        cache = ScopedCache(backend, ttl=app.config['STATS_CACHE_TTL'])
+        app.extensions['stats_cache'] = cache
+    return cache
+
+# Cached entries that depend on the students of a (school, department)
+SCOPED_CACHE_NAMES = ('dashboard', 'stats')
+
+def invalidate_student_caches(school, department):
+    cache = get_stats_cache()
+    cache.invalidate(SCOPED_CACHE_NAMES, school, department)
+    cache.delete('dashboard:recent')
+
+def get_user_cache():
+    cache = app.extensions.get('user_cache')
+    if cache is None:
+        cache = MemoryBackend(maxsize=app.config['USER_CACHE_SIZE'])
+        app.extensions['user_cache'] = cache
+    return cache
+
+def load_user(conn, username):
+    # User rows rarely change; keep recently seen ones in memory
+    cache = get_user_cache()
+    user = cache.get(username)
+    if user is MISSING:
+        row = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+        user = dict(row) if row else None
+        if user:
+            cache.set(username, user, app.config['USER_CACHE_TTL'])
+    return user
+
+def get_session_store():
+    store = app.extensions.get('session_store')
+    if store is None:
+        if app.config['SESSION_BACKEND'] == 'memory':
+            store = MemorySessionStore(maxsize=app.config['SESSION_MEMORY_SIZE'])
+        else:
+            store = SQLiteSessionStore(app.config['SESSION_DB_PATH'],
+                                       local_cache_size=app.config['SESSION_LOCAL_CACHE_SIZE'],
+                                       local_ttl=app.config['SESSION_LOCAL_TTL'])
+        app.extensions['session_store'] = store
+    return store
+
+app.session_interface = ServerSideSessionInterface(get_session_store,
+                                                   sweep_interval=app.config['SESSION_SWEEP_INTERVAL'])
+
+def get_catalog():
+    catalog = app.extensions.get('catalog')
+    if catalog is None:
+        catalog = Catalog(check_interval=app.config['CATALOG_CHECK_INTERVAL'])
+        app.extensions['catalog'] = catalog
+    return catalog
+
+def get_authorizer():
+    authorizer = app.extensions.get('authorizer')
+    if authorizer is None:
+        authorizer = ScopeAuthorizer(maxsize=app.config['AUTHZ_CACHE_SIZE'],
+                                     file_ttl=app.config['AUTHZ_FILE_TTL'])
+        app.extensions['authorizer'] = authorizer
+    return authorizer
+
+def get_blob_store():
+    store = app.extensions.get('blob_store')
+    if store is None:
+        store = BlobStore(app.config['UPLOAD_FOLDER'])
+        app.extensions['blob_store'] = store
+    return store
+
+def run_thumbnail_job(payload):
+    generate_thumbnail(app.config['UPLOAD_FOLDER'], payload['path'],
+                       size=tuple(app.config['THUMBNAIL_SIZE']), fmt=app.config['THUMBNAIL_FORMAT'])
+
+def maintenance_options(dry_run=False, fix=None):
+    return {
+        'root': os.path.abspath(app.config['UPLOAD_FOLDER']),
+        'batch_size': app.config['MAINTENANCE_BATCH_SIZE'],
+        'grace': app.config['ORPHAN_GRACE_PERIOD'],
+        'session_ttl': app.config['UPLOAD_SESSION_TTL'],
+        'analysis_limit': app.config['ANALYSIS_LIMIT'],
+        'vacuum_pages': app.config['VACUUM_PAGES'],
+        'change_retention': app.config['CHANGES_RETENTION'],
+        'job_retention': app.config['JOB_RETENTION'],
+        'dry_run': dry_run,
+        'fix': app.config['MAINTENANCE_FIX_DANGLING'] if fix is None else fix,
+    }
+
+def run_maintenance_job(payload):
+    # One step of a maintenance task; the next step is queued as a new job
+    # so other jobs and requests get their turn in between
+    conn = sqlite3.connect(app.config['DATABASE'], timeout=30)
+    try:
+        conn.execute(f"PRAGMA busy_timeout = {int(app.config['DB_BUSY_TIMEOUT'])}")
+        state = payload.get('state', {})
+        if run_step(conn, payload['task'], maintenance_options(), state):
+            with conn:
+                enqueue(conn, 'maintenance', {'task': payload['task'], 'state': state},
+                        delay=app.config['MAINTENANCE_THROTTLE'])
+    finally:
+        conn.close()
+
+JOB_HANDLERS = {
+    'thumbnail': run_thumbnail_job,
+    'maintenance': run_maintenance_job,
+}
+
+def get_job_workers(workers=None):
+    pool = app.extensions.get('job_workers')
+    if pool is None:
+        pool = WorkerPool(app.config['DATABASE'], JOB_HANDLERS,
+                          workers=app.config['JOB_WORKERS'] if workers is None else workers,
+                          poll_interval=app.config['JOB_POLL_INTERVAL'])
+        app.extensions['job_workers'] = pool
+    return pool
+
+def wake_job_workers():
+    # Called after a commit that queued jobs; starts the workers on first use
+    pool = get_job_workers()
+    if pool.workers:
+        pool.start()
+        pool.notify()
+
+def start_job_workers():
+    # Once per process: jobs left running by a worker that died are queued
+    # again, and with JOB_WORKERS the pool starts on whatever is queued
+    # instead of waiting for this process's first upload
+    if not app.config['JOB_WORKERS']:
+        return
+    conn = sqlite3.connect(app.config['DATABASE'], timeout=30)
+    try:
+        requeue_stale(conn)
+    finally:
+        conn.close()
+    wake_job_workers()
+
+def get_maintenance_scheduler():
+    scheduler = app.extensions.get('maintenance_scheduler')
+    if scheduler is None:
+        scheduler = MaintenanceScheduler(app.config['DATABASE'], app.config['MAINTENANCE_INTERVALS'],
+                                         on_queued=wake_job_workers)
+        app.extensions['maintenance_scheduler'] = scheduler
+    return scheduler
+
+@app.before_request
+def start_maintenance_scheduler():
+    if app.config['MAINTENANCE_SCHEDULER']:
+        get_maintenance_scheduler().start()
+
+def queue_thumbnail(conn, path):
+    # Thumbnails are generated after the upload request has returned
+    if needs_thumbnail(path):
+        enqueue(conn, 'thumbnail', {'path': path})
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[1].lower()
+
+def student_in_scope(conn, student_id):
+    return get_authorizer().can_access_student(conn, session['role'], session.get('school'),
+                                               session.get('department'), student_id)
+
 def get_db_connection():
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
+    # One pooled connection per request, returned in close_db_connection()
+    if 'db' not in g:
+        conn = get_pool().acquire()
+        g.db_changes = conn.total_changes
+        if 'request_stats' in g:
+            conn = InstrumentedConnection(conn, g.request_stats)
+        g.db = conn
+    return g.db
+
+def stale_reads(f):
+    # Marks a route whose reads may lag behind the primary database by up
+    # to REPLICA_MAX_LAG seconds; see get_read_connection()
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.stale_reads = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+def get_read_connection():
+    # Connection for read-only queries. Routes that did not declare
+    # @stale_reads, and users who just wrote something, read from the primary
+    # connection. Otherwise the least stale replica within REPLICA_MAX_LAG is
+    # used, falling back to the read-only pool on the primary.
+    if 'read_db' in g:
+        return g.read_db
+    max_lag = app.config['REPLICA_MAX_LAG']
+    if not g.get('stale_reads') or time.time() - session.get('last_write', 0) < max_lag:
+        return get_db_connection()
+    pool = get_read_pool()
+    best = None
+    for replica in get_replicas():
+        lag = replica.lag()
+        if lag is not None and lag <= max_lag and (best is None or lag < best):
+            best = lag
+            pool = replica.pool
+    conn = pool.acquire()
+    g.read_pool = pool
+    if 'request_stats' in g:
+        conn = InstrumentedConnection(conn, g.request_stats)
+    g.read_db = conn
     return conn
 
+def read_primary(load):
+    # Runs load(conn) on the read-only pool on the primary, never a replica.
+    # For cache fills: a replica that has not yet copied the write that
+    # invalidated an entry would put the old value back for the whole TTL.
+    pool = get_read_pool()
+    conn = pool.acquire()
+    try:
+        if 'request_stats' in g:
+            return load(InstrumentedConnection(conn, g.request_stats))
+        return load(conn)
+    finally:
+        pool.release(conn)
+
+@app.after_request
+def remember_writes(response):
+    # Lets get_read_connection() send this user's next reads to the primary
+    if 'db' in g and g.db.total_changes != g.db_changes:
+        session['last_write'] = time.time()
+    return response
+
+@app.teardown_appcontext
+def close_db_connection(exception):
+    conn = g.pop('db', None)
+    if isinstance(conn, InstrumentedConnection):
+        conn = conn.connection
+    if conn is not None:
+        get_pool().release(conn)
+    conn = g.pop('read_db', None)
+    if isinstance(conn, InstrumentedConnection):
+        conn = conn.connection
+    if conn is not None:
+        g.pop('read_pool').release(conn)
+
+def get_metrics():
+    metrics = app.extensions.get('metrics')
+    if metrics is None:
+        metrics = Metrics(slow_query_seconds=app.config['METRICS_SLOW_QUERY_MS'] / 1000)
+        app.extensions['metrics'] = metrics
+    return metrics
+
+def get_profiler():
+    profiler = app.extensions.get('profiler')
+    if profiler is None:
+        profiler = SamplingProfiler(app.config['PROFILER_DIR'],
+                                    interval=app.config['PROFILER_INTERVAL'],
+                                    threshold=app.config['PROFILER_THRESHOLD_MS'] / 1000,
+                                    keep=app.config['PROFILER_KEEP'])
+        app.extensions['profiler'] = profiler
+    return profiler
+
+@app.before_request
+def start_request_metrics():
+    if app.config['METRICS_ENABLED']:
+        g.request_started = time.perf_counter()
+        g.request_stats = get_metrics().start_request()
+        if app.config['PROFILER_ENABLED']:
+            get_profiler().begin()
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed responses are measured up to the first byte; the rest of the
+    # body is generated after this hook
+    if 'request_stats' in g:
+        elapsed = time.perf_counter() - g.request_started
+        endpoint = request.endpoint or 'unmatched'
+        stats = g.request_stats
+        get_metrics().finish_request(endpoint, request.method, response.status_code, elapsed, stats)
+        for sql, duration in stats.slow_queries:
+            app.logger.warning('Slow query in %s (%.1f ms): %s', endpoint, duration * 1000, sql)
+        if app.config['PROFILER_ENABLED']:
+            dump = get_profiler().end(endpoint, elapsed)
+            if dump:
+                app.logger.info('Profile of %s (%.0f ms) written to %s', endpoint, elapsed * 1000, dump)
+    return response
+
 def login_required(role=None):
     def decorator(f):
         @wraps(f)
@@ -131,10 +679,16 @@ def login():
         password = request.form['password']
         
         conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
-        conn.close()
+        user = load_user(conn, username)
+        policy = get_password_policy()
         
-        if user and check_password_hash(user['password'], password):
+        if user and policy.verify(user['password'], password):
+            if policy.needs_rehash(user['password']):
+                conn.execute('UPDATE users SET password = ? WHERE id = ?', (policy.hash(password), user['id']))
+                conn.commit()
+                get_user_cache().delete_many([username])
+            conn.close()
+            session.regenerate()
             session['username'] = user['username']
             session['role'] = user['role']
             session['school'] = user['school']
@@ -142,6 +696,7 @@ def login():
             flash('Login successful!', 'success')
             return redirect(url_for('dashboard'))
         else:
+            conn.close()
             flash('Invalid username or password', 'danger')
     
     return render_template('login.html')
@@ -155,36 +710,22 @@ def logout():
 @app.route('/dashboard')
 @login_required()
 def dashboard():
-    conn = get_db_connection()
+    scope = scope_key(session['role'], session.get('school'), session.get('department'))
+    cache = get_stats_cache()
+    counts = cache.get_or_compute(f'dashboard:{scope}', lambda: read_primary(load_dashboard_counts))
     
     if session['role'] == 'super_admin':
-        # Super admin sees all schools and departments
-        schools = conn.execute('SELECT DISTINCT school FROM students').fetchall()
-        departments = conn.execute('SELECT DISTINCT department FROM students').fetchall()
-        total_students = conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
+        schools = counts['schools']
+        departments = counts['departments']
     elif session['role'] == 'school':
-        # School admin sees all departments in their school
-        departments = conn.execute('SELECT DISTINCT department FROM students WHERE school = ?', 
-                                  (session['school'],)).fetchall()
-        total_students = conn.execute('SELECT COUNT(*) FROM students WHERE school = ?', 
-                                     (session['school'],)).fetchone()[0]
+        departments = counts['departments']
         schools = [{'school': session['school']}]
     else:
-        # Department admin sees only their department
         departments = [{'department': session['department']}]
-        total_students = conn.execute('SELECT COUNT(*) FROM students WHERE department = ?', 
-                                    (session['department'],)).fetchone()[0]
         schools = [{'school': session['school']}]
     
     # Get recent students (last 5 added)
-    recent_students = conn.execute('''
-        SELECT student_id, name, department, created_at 
-        FROM students 
-        ORDER BY created_at DESC 
-        LIMIT 5
-    ''').fetchall()
-    
-    conn.close()
+    recent_students = cache.get_or_compute('dashboard:recent', lambda: read_primary(load_recent_students))
     
     return render_template('dashboard.html', 
                          role=session['role'],
@@ -192,37 +733,53 @@ def dashboard():
                          department=session.get('department'),
                          schools=schools,
                          departments=departments,
-                         total_students=total_students,
+                         total_students=counts['total_students'],
                          recent_students=recent_students)
 
+def load_dashboard_counts(conn):
+    # Counts come from the student_counts summary table, which has one row
+    # per (school, department) and is kept up to date by triggers
+    if session['role'] == 'super_admin':
+        # Super admin sees all schools and departments
+        schools = conn.execute(queries.DASHBOARD_SCHOOLS).fetchall()
+        departments = conn.execute(queries.DASHBOARD_DEPARTMENTS).fetchall()
+        total_students = conn.execute(queries.DASHBOARD_TOTAL).fetchone()[0]
+    elif session['role'] == 'school':
+        # School admin sees all departments in their school
+        schools = []
+        departments = conn.execute(queries.SCHOOL_DEPARTMENTS, (session['school'],)).fetchall()
+        total_students = conn.execute(queries.SCHOOL_TOTAL, (session['school'],)).fetchone()[0]
+    else:
+        # Department admin sees only their department
+        schools = []
+        departments = []
+        total_students = conn.execute(queries.DEPARTMENT_TOTAL, (session['department'],)).fetchone()[0]
+    
+    return {
+        'schools': [dict(row) for row in schools],
+        'departments': [dict(row) for row in departments],
+        'total_students': total_students
+    }
+
+def load_recent_students(conn):
+    recent_students = conn.execute(queries.RECENT_STUDENTS).fetchall()
+    return [dict(row) for row in recent_students]
+
 @app.route('/api/student_stats')
 @login_required()
 def student_stats():
-    conn = get_db_connection()
-    
+    scope = scope_key(session['role'], session.get('school'), session.get('department'))
+    return jsonify(get_stats_cache().get_or_compute(f'stats:{scope}', lambda: read_primary(load_student_stats)))
+
+def load_student_stats(conn):
     # Base query based on role
     if session['role'] == 'super_admin':
-        query = '''
-            SELECT school, department, COUNT(*) as count 
-            FROM students 
-            GROUP BY school, department
-            ORDER BY school, department
-        '''
-        stats = conn.execute(query).fetchall()
+        stats = [dict(row) for row in conn.execute(queries.STATS_ALL)]
     elif session['role'] == 'school':
-        query = '''
-            SELECT department, COUNT(*) as count 
-            FROM students 
-            WHERE school = ?
-            GROUP BY department
-            ORDER BY department
-        '''
-        stats = conn.execute(query, (session['school'],)).fetchall()
+        stats = [dict(row) for row in conn.execute(queries.STATS_SCHOOL, (session['school'],))]
     else:
-        query = 'SELECT COUNT(*) as count FROM students WHERE department = ?'
-        stats = [{'department': session['department'], 'count': conn.execute(query, (session['department'],)).fetchone()['count']}]
-    
-    conn.close()
+        stats = [{'department': session['department'],
+                  'count': conn.execute(queries.STATS_DEPARTMENT, (session['department'],)).fetchone()['count']}]
     
     # Format for Chart.js
     labels = []
@@ -230,10 +787,10 @@ def student_stats():
     background_colors = []
     
     for stat in stats:
-        if 'department' in stat:
-            labels.append(stat['department'])
-        else:
+        if 'school' in stat:
             labels.append(f"{stat['school']} - {stat['department']}")
+        else:
+            labels.append(stat['department'])
         
         data.append(stat['count'])
         
@@ -243,11 +800,11 @@ def student_stats():
         else:
             background_colors.append('#10B981')  # Green for Arts
     
-    return jsonify({
+    return {
         'labels': labels,
         'data': data,
         'background_colors': background_colors
-    })
+    }
 
 @app.route('/insert', methods=['GET', 'POST'])
 @login_required()
@@ -270,15 +827,15 @@ def insert_student():
         
         # Validate department belongs to school
         conn = get_db_connection()
-        valid_dept = conn.execute('SELECT 1 FROM students WHERE school = ? AND department = ? LIMIT 1',
-                                (school, department)).fetchone()
+        catalog = get_catalog()
+        valid_dept = catalog.has_department(conn, school, department)
         if not valid_dept and session['role'] != 'super_admin':
             conn.close()
             flash('Invalid department for this school', 'danger')
             return redirect(url_for('insert_student'))
         
         # Check if student ID already exists
-        existing = conn.execute('SELECT 1 FROM students WHERE student_id = ?', (student_id,)).fetchone()
+        existing = conn.execute(queries.STUDENT_EXISTS, (student_id,)).fetchone()
         if existing:
             conn.close()
             flash('Student ID already exists', 'danger')
@@ -287,10 +844,13 @@ def insert_student():
         # Handle photo upload
         photo_path = None
         if photo and allowed_file(photo.filename):
-            filename = secure_filename(f"{student_id}_photo.{photo.filename.rsplit('.', 1)[1].lower()}")
-            photo_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            photo.save(photo_path)
-            photo_path = filename  # Store relative path
+            photo_path = get_blob_store().save(conn, photo.stream, file_extension(photo.filename))
+            queue_thumbnail(conn, photo_path)
+        
+        # A super admin may add a student to a department that is not in the
+        # catalog yet; it is added along with the student
+        if not valid_dept:
+            add_departments(conn, [(school, department)])
         
         # Insert student record
         conn.execute('''
@@ -300,20 +860,27 @@ def insert_student():
         
         conn.commit()
         conn.close()
+        if not valid_dept:
+            catalog.invalidate()
+        if photo_path:
+            wake_job_workers()
+            # The blob may already be cached as belonging to other students
+            get_authorizer().invalidate_file(photo_path)
+        invalidate_student_caches(school, department)
         
         flash('Student added successfully!', 'success')
         return redirect(url_for('dashboard'))
     
     # For GET request - show form
     conn = get_db_connection()
+    catalog = get_catalog()
     
     if session['role'] == 'super_admin':
-        schools = conn.execute('SELECT DISTINCT school FROM students').fetchall()
-        departments = conn.execute('SELECT DISTINCT department FROM students').fetchall()
+        schools = [{'school': name} for name in catalog.schools(conn)]
+        departments = [{'department': name} for name in catalog.departments(conn)]
     elif session['role'] == 'school':
         schools = [{'school': session['school']}]
-        departments = conn.execute('SELECT DISTINCT department FROM students WHERE school = ?',
-                                 (session['school'],)).fetchall()
+        departments = [{'department': name} for name in catalog.departments(conn, session['school'])]
     else:
         schools = [{'school': session['school']}]
         departments = [{'department': session['department']}]
@@ -322,6 +889,447 @@ def insert_student():
     
     return render_template('insert.html', schools=schools, departments=departments)
 
+def record_imported_departments(conn, touched):
+    # Departments first seen in a super admin import join the catalog
+    catalog = get_catalog()
+    new_pairs = set(touched) - catalog.pairs(conn)
+    if new_pairs:
+        add_departments(conn, sorted(new_pairs))
+        conn.commit()
+        catalog.invalidate()
+
+@app.route('/import', methods=['POST'])
+@login_required()
+def import_students_file():
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'No file selected'}), 400
+    
+    fmt = request.form.get('format') or detect_format(upload.filename)
+    conn = get_db_connection()
+    rows = clean_records(read_records(upload.stream, fmt), session['role'],
+                         session.get('school'), session.get('department'))
+    try:
+        report = import_students(conn, rows, get_catalog().pairs(conn),
+                                 allow_new_pairs=session['role'] == 'super_admin',
+                                 batch_size=app.config['IMPORT_BATCH_SIZE'])
+        touched = report.pop('touched')
+        record_imported_departments(conn, touched)
+    except ImportFormatError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    
+    for school, department in touched:
+        invalidate_student_caches(school, department)
+    
+    return jsonify(report)
+
+@app.route('/api/catalog')
+@login_required()
+def catalog_list():
+    conn = get_db_connection()
+    catalog = get_catalog().as_dict(conn)
+    conn.close()
+    if session['role'] != 'super_admin':
+        catalog = {session['school']: catalog.get(session['school'], [])}
+    return jsonify(catalog)
+
+@app.route('/api/catalog/schools', methods=['POST'])
+@login_required('super_admin')
+def catalog_add_school():
+    name = ((request.get_json(silent=True) or request.form).get('name') or '').strip()
+    if not name:
+        return jsonify({'error': 'School name is required'}), 400
+    conn = get_db_connection()
+    conn.execute('INSERT OR IGNORE INTO schools (name) VALUES (?)', (name,))
+    conn.commit()
+    conn.close()
+    get_catalog().invalidate()
+    return jsonify({'school': name}), 201
+
+@app.route('/api/catalog/schools/<name>', methods=['DELETE'])
+@login_required('super_admin')
+def catalog_delete_school(name):
+    conn = get_db_connection()
+    if conn.execute('SELECT 1 FROM departments WHERE school = ? LIMIT 1', (name,)).fetchone():
+        conn.close()
+        return jsonify({'error': 'School still has departments'}), 409
+    deleted = conn.execute('DELETE FROM schools WHERE name = ?', (name,)).rowcount
+    conn.commit()
+    conn.close()
+    if not deleted:
+        abort(404)
+    get_catalog().invalidate()
+    return '', 204
+
+@app.route('/api/catalog/departments', methods=['POST'])
+@login_required('super_admin')
+def catalog_add_department():
+    data = request.get_json(silent=True) or request.form
+    school = (data.get('school') or '').strip()
+    name = (data.get('name') or '').strip()
+    if not school or not name:
+        return jsonify({'error': 'School and department name are required'}), 400
+    conn = get_db_connection()
+    add_departments(conn, [(school, name)])
+    conn.commit()
+    conn.close()
+    get_catalog().invalidate()
+    return jsonify({'school': school, 'department': name}), 201
+
+@app.route('/api/catalog/departments/<school>/<name>', methods=['DELETE'])
+@login_required('super_admin')
+def catalog_delete_department(school, name):
+    conn = get_db_connection()
+    if conn.execute('SELECT 1 FROM student_counts WHERE school = ? AND department = ?', (school, name)).fetchone():
+        conn.close()
+        return jsonify({'error': 'Department still has students'}), 409
+    deleted = conn.execute('DELETE FROM departments WHERE school = ? AND name = ?', (school, name)).rowcount
+    conn.commit()
+    conn.close()
+    if not deleted:
+        abort(404)
+    get_catalog().invalidate()
+    return '', 204
+
+def encode_cursor(created_at, row_id):
+    return base64.urlsafe_b64encode(json.dumps([created_at, row_id]).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(created_at), int(row_id)
+    except (ValueError, TypeError):
+        abort(400)
+
+@app.route('/api/students')
+@login_required()
+def list_students():
+    # Keyset pagination on (created_at, id), newest first. The cursor is the
+    # last row of the previous page, so every page is an index seek.
+    try:
+        limit = int(request.args.get('limit', app.config['STUDENTS_PAGE_SIZE']))
+    except ValueError:
+        abort(400)
+    limit = max(1, min(limit, app.config['STUDENTS_MAX_PAGE_SIZE']))
+    
+    conditions = []
+    params = ()
+    
+    # Role scoping first, then the optional filters
+    school = request.args.get('school')
+    department = request.args.get('department')
+    if session['role'] == 'school':
+        school = session['school']
+    elif session['role'] == 'department':
+        department = session['department']
+        school = None
+    if school:
+        conditions.append(queries.SCHOOL)
+        params += (school,)
+    if department:
+        conditions.append(queries.DEPARTMENT)
+        params += (department,)
+    if request.args.get('created_from'):
+        conditions.append(queries.CREATED_FROM)
+        params += (request.args['created_from'],)
+    if request.args.get('created_to'):
+        conditions.append(queries.CREATED_TO)
+        params += (request.args['created_to'],)
+    if request.args.get('cursor'):
+        conditions.append(queries.BEFORE_CURSOR)
+        params += decode_cursor(request.args['cursor'])
+    
+    query = queries.student_page(conditions)
+    params += (limit + 1,)
+    
+    def generate():
+        conn = get_db_connection()
+        yield '{"students": ['
+        last = None
+        for count, row in enumerate(conn.execute(query, params)):
+            if count == limit:
+                # There is at least one more row, hand out a cursor for it
+                yield '], "next_cursor": ' + json.dumps(encode_cursor(last['created_at'], last['id'])) + '}'
+                return
+            yield (',' if count else '') + json.dumps(dict(row))
+            last = row
+        yield '], "next_cursor": null}'
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+def request_scope():
+    # (school, department) a feed or export covers: the caller's school or
+    # department, or for a super admin the optional ?school= and
+    # ?department= filters. None means any.
+    school = request.args.get('school')
+    department = request.args.get('department')
+    if session['role'] == 'school':
+        school = session['school']
+    elif session['role'] == 'department':
+        school, department = None, session['department']
+    return school, department
+
+def export_scope():
+    school, department = request_scope()
+    conditions = []
+    params = ()
+    if school:
+        conditions.append(queries.SCHOOL)
+        params += (school,)
+    if department:
+        conditions.append(queries.DEPARTMENT)
+        params += (department,)
+    return conditions, params
+
+def iter_batches(query, params):
+    # Runs query (which must select id first and end in "id > ? ORDER BY id
+    # LIMIT ?") page by page, so a long export never holds a read
+    # transaction open for its whole duration
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+    last_id = 0
+    while True:
+        rows = get_read_connection().execute(query, params + (last_id, batch_size)).fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['id']
+
+def roster_rows(conditions, params):
+    for row in iter_batches(queries.roster_batch(conditions), params):
+        yield [row[field] for field in STUDENT_FIELDS] + [row['created_at'], row['documents']]
+
+ROSTER_HEADER = list(STUDENT_FIELDS) + ['created_at', 'documents']
+
+def export_filename(extension):
+    scope = session.get('department') or session.get('school') or 'all'
+    return secure_filename(f"students-{scope}-{time.strftime('%Y%m%d')}.{extension}") or f'students.{extension}'
+
+def streamed_download(chunks, mimetype, filename):
+    # No Content-Length, so the body goes out with chunked transfer encoding
+    # as it is generated; X-Accel-Buffering stops nginx from buffering it
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/export/students.csv')
+@login_required()
+@stale_reads
+def export_roster():
+    conditions, params = export_scope()
+    return streamed_download(iter_csv(ROSTER_HEADER, roster_rows(conditions, params)),
+                             'text/csv', export_filename('csv'))
+
+@app.route('/export/documents.zip')
+@login_required()
+@stale_reads
+def export_documents():
+    # roster.csv followed by <student_id>/<document name> for every document
+    # of every student in scope. Files missing on disk are listed in
+    # missing.txt at the end of the archive.
+    conditions, params = export_scope()
+    store = get_blob_store()
+
+    def entries():
+        today = time.localtime()[:6]
+        yield 'roster.csv', today, iter_csv(ROSTER_HEADER, roster_rows(conditions, params))
+        names = set()
+        missing = []
+        for row in iter_batches(queries.document_batch(conditions), params):
+            path = store.full_path(row['document_path'])
+            if not os.path.isfile(path):
+                missing.append(f"{row['student_id']}: {row['document_name']} ({row['document_path']})")
+                continue
+            filename = secure_filename(row['document_name']) or 'document'
+            if '.' not in filename and '.' in row['document_path']:
+                filename += '.' + file_extension(row['document_path'])
+            name = f"{secure_filename(row['student_id']) or 'student'}/{filename}"
+            stem, dot, ext = name.rpartition('.')
+            copy = 1
+            while name in names:
+                copy += 1
+                name = f'{stem} ({copy}){dot}{ext}'
+            names.add(name)
+            yield name, zip_date_time(row['upload_date']), iter_file(path)
+        if missing:
+            yield 'missing.txt', today, [('\n'.join(missing) + '\n').encode('utf-8')]
+
+    return streamed_download(stream_zip(entries()), 'application/zip', export_filename('zip'))
+
+def change_in_scope(change, school, department):
+    # How a change looks from a scope: 'insert' for a student that moved in,
+    # 'delete' for one that moved out, None if it does not concern the scope
+    def matches(row_school, row_department):
+        return (school is None or row_school == school) and (department is None or row_department == department)
+
+    if matches(change['school'], change['department']):
+        if change['op'] == 'update' and (change['old_school'] or change['old_department']) and \
+                not matches(change['old_school'] or change['school'], change['old_department'] or change['department']):
+            return 'insert'
+        return change['op']
+    if change['op'] == 'update' and (change['old_school'] or change['old_department']) and \
+            matches(change['old_school'] or change['school'], change['old_department'] or change['department']):
+        return 'delete'
+    return None
+
+def read_changes(since, limit, school, department):
+    # The next limit changes after seq since, filtered down to the scope.
+    # Returns (changes, last seq read, whether there are more). A connection
+    # is only held for the query, never while a long poll waits.
+    pool = get_read_pool()
+    conn = pool.acquire()
+    try:
+        rows = conn.execute(queries.CHANGES_PAGE, (since, limit)).fetchall()
+    finally:
+        pool.release(conn)
+    changes = []
+    for row in rows:
+        op = change_in_scope(row, school, department)
+        if op is not None:
+            changes.append({'seq': row['seq'], 'entity': row['entity'], 'op': op, 'id': row['row_id'],
+                            'student_id': row['student_id'], 'changed_at': row['changed_at'],
+                            'data': json.loads(row['data']) if row['data'] else None})
+    return changes, rows[-1]['seq'] if rows else since, len(rows) == limit
+
+def change_log_bounds():
+    pool = get_read_pool()
+    conn = pool.acquire()
+    try:
+        oldest = conn.execute(queries.CHANGES_OLDEST).fetchone()[0]
+        last = conn.execute(queries.CHANGES_LAST).fetchone()
+    finally:
+        pool.release(conn)
+    return oldest, last[0] if last else 0
+
+class Pause(bytes):
+    # Empty body chunk asking the server to wait seconds before it asks the
+    # response for the next one. asgi.py waits on its event loop, with no
+    # thread held, and says so in environ['student_mgmt.pause']; under any
+    # other server pauser() sleeps in the thread instead.
+    def __new__(cls, seconds):
+        pause = super().__new__(cls, b'')
+        pause.seconds = seconds
+        return pause
+
+def pauser():
+    # Called in the view, since the response generators run after it returns
+    if request.environ.get('student_mgmt.pause'):
+        return Pause
+
+    def sleep(seconds):
+        time.sleep(seconds)
+        return b''
+    return sleep
+
+def sse_changes(since, limit, school, department, pause):
+    # Server-sent events: one 'change' event per change, with seq as the
+    # event ID so a reconnecting EventSource resumes from Last-Event-ID.
+    # The stream ends after CHANGES_STREAM_MAX_AGE seconds and the client
+    # reconnects after the retry interval, so no stream lives forever.
+    poll = app.config['CHANGES_POLL_INTERVAL']
+    heartbeat = app.config['CHANGES_HEARTBEAT']
+    ends = time.monotonic() + app.config['CHANGES_STREAM_MAX_AGE']
+    last_sent = time.monotonic()
+    yield f"retry: {int(poll * 1000)}\n\n"
+    while time.monotonic() < ends:
+        changes, since, more = read_changes(since, limit, school, department)
+        for change in changes:
+            yield f"id: {change['seq']}\nevent: change\ndata: {json.dumps(change)}\n\n"
+            last_sent = time.monotonic()
+        if more:
+            continue
+        if time.monotonic() - last_sent >= heartbeat:
+            # Comment line; also finds out about clients that have gone
+            yield ': keep-alive\n\n'
+            last_sent = time.monotonic()
+        yield pause(poll)
+
+def long_poll_changes(since, limit, school, department, deadline, pause):
+    # The rest of a ?wait= long poll that found nothing on its first read
+    poll = app.config['CHANGES_POLL_INTERVAL']
+    while True:
+        yield pause(min(poll, max(deadline - time.monotonic(), 0)))
+        changes, since, more = read_changes(since, limit, school, department)
+        if changes or more or time.monotonic() >= deadline:
+            break
+    yield json.dumps({'changes': changes, 'last_seq': since, 'more': more})
+
+@app.route('/api/changes')
+@login_required()
+def api_changes():
+    # Change feed for downstream systems: insert, update and delete of
+    # students and documents in the caller's scope, in commit order, after
+    # ?since=<seq>. Without since only the current position is returned, to
+    # be taken before a full export. ?wait=<seconds> long-polls until there
+    # is something; Accept: text/event-stream streams server-sent events.
+    school, department = request_scope()
+    oldest, last = change_log_bounds()
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'changes': [], 'last_seq': last, 'more': False})
+    if since < (oldest if oldest is not None else last + 1) - 1:
+        # Pruned by the prune_changes maintenance task
+        return jsonify({'error': 'changes after this seq are no longer kept, resync from a full export',
+                        'oldest_seq': oldest, 'last_seq': last}), 410
+    limit = max(1, min(request.args.get('limit', app.config['CHANGES_PAGE_SIZE'], type=int),
+                       app.config['CHANGES_MAX_PAGE_SIZE']))
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        response = Response(sse_changes(since, limit, school, department, pauser()), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-store'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    deadline = time.monotonic() + max(0.0, min(request.args.get('wait', 0, type=float),
+                                               app.config['CHANGES_MAX_WAIT']))
+    changes, since, more = read_changes(since, limit, school, department)
+    if changes or more or time.monotonic() >= deadline:
+        return jsonify({'changes': changes, 'last_seq': since, 'more': more})
+    # Waiting is a streamed response, so that under asgi.py it holds no thread
+    return Response(long_poll_changes(since, limit, school, department, deadline, pauser()),
+                    mimetype='application/json')
+
+def build_match_query(text):
+    # Every word must match, as a prefix, in any column. Quoting each token
+    # keeps FTS5 syntax characters in user input from being interpreted.
+    tokens = re.findall(r'\w+', text)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+@app.route('/api/search')
+@login_required()
+def full_text_search():
+    match = build_match_query(request.args.get('q', ''))
+    if not match:
+        return jsonify({'results': []})
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        abort(400)
+    limit = max(1, min(limit, app.config['SEARCH_MAX_RESULTS']))
+    
+    conditions = []
+    params = (match,)
+    
+    if session['role'] == 'school':
+        conditions.append(queries.SCHOOL)
+        params += (session['school'],)
+    elif session['role'] == 'department':
+        conditions.append(queries.DEPARTMENT)
+        params += (session['department'],)
+    
+    params += (limit,)
+    
+    conn = get_db_connection()
+    results = [dict(row) for row in conn.execute(queries.student_search(conditions), params)]
+    conn.close()
+    
+    return jsonify({'results': results})
+
 @app.route('/search', methods=['GET', 'POST'])
 @login_required()
 def search_student():
@@ -331,17 +1339,17 @@ def search_student():
         conn = get_db_connection()
         
         # Build query based on user role
-        query = 'SELECT * FROM students WHERE student_id = ?'
+        conditions = []
         params = (student_id,)
         
         if session['role'] == 'school':
-            query += ' AND school = ?'
+            conditions.append(queries.SCHOOL)
             params += (session['school'],)
         elif session['role'] == 'department':
-            query += ' AND department = ?'
+            conditions.append(queries.DEPARTMENT)
             params += (session['department'],)
         
-        student = conn.execute(query, params).fetchone()
+        student = conn.execute(queries.student_lookup(conditions), params).fetchone()
         
         if not student:
             conn.close()
@@ -349,11 +1357,15 @@ def search_student():
             return redirect(url_for('search_student'))
         
         # Get documents for this student
-        documents = conn.execute('SELECT * FROM documents WHERE student_id = ?', (student_id,)).fetchall()
+        documents = conn.execute(queries.STUDENT_DOCUMENTS, (student_id,)).fetchall()
         
         conn.close()
         
-        return render_template('student_details.html', student=student, documents=documents)
+        # Documents shown by their preview instead of a file type icon
+        previews = {doc['document_path'] for doc in documents
+                    if needs_thumbnail(doc['document_path']) and generated_thumbnail(doc['document_path'])}
+        
+        return render_template('student_details.html', student=student, documents=documents, previews=previews)
     
     return render_template('search.html')
 
@@ -363,22 +1375,12 @@ def edit_student(student_id):
     conn = get_db_connection()
     
     # First verify the student exists and user has permission
-    query = 'SELECT * FROM students WHERE student_id = ?'
-    params = (student_id,)
-    
-    if session['role'] == 'school':
-        query += ' AND school = ?'
-        params += (session['school'],)
-    elif session['role'] == 'department':
-        query += ' AND department = ?'
-        params += (session['department'],)
-    
-    student = conn.execute(query, params).fetchone()
-    
-    if not student:
+    if not student_in_scope(conn, student_id):
         conn.close()
         abort(404)
     
+    student = conn.execute(queries.STUDENT, (student_id,)).fetchone()
+    
     if request.method == 'POST':
         name = request.form['name']
         email = request.form['email']
@@ -386,20 +1388,14 @@ def edit_student(student_id):
         photo = request.files['photo']
         
         # Handle photo update
+        store = get_blob_store()
         photo_path = student['photo_path']
+        old_photo_unused = False
         if photo and allowed_file(photo.filename):
-            # Delete old photo if exists
-            if photo_path:
-                try:
-                    os.remove(os.path.join(app.config['UPLOAD_FOLDER'], photo_path))
-                except OSError:
-                    pass
-            
-            # Save new photo
-            filename = secure_filename(f"{student_id}_photo.{photo.filename.rsplit('.', 1)[1].lower()}")
-            new_photo_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            photo.save(new_photo_path)
-            photo_path = filename
+            photo_path = store.save(conn, photo.stream, file_extension(photo.filename))
+            queue_thumbnail(conn, photo_path)
+            if student['photo_path']:
+                old_photo_unused = store.release(conn, student['photo_path'])
         
         # Update student record
         conn.execute('''
@@ -409,7 +1405,17 @@ def edit_student(student_id):
         ''', (name, email, phone, photo_path, student_id))
         
         conn.commit()
+        if old_photo_unused:
+            store.discard(conn, student['photo_path'])
         conn.close()
+        if photo_path != student['photo_path']:
+            wake_job_workers()
+            get_authorizer().invalidate_file(photo_path)
+        if student['photo_path']:
+            get_authorizer().invalidate_file(student['photo_path'])
+        get_authorizer().invalidate_student(student_id)
+        # Counts are unchanged, only the recent students list shows names
+        get_stats_cache().delete('dashboard:recent')
         
         flash('Student updated successfully!', 'success')
         return redirect(url_for('search_student'))
@@ -421,7 +1427,14 @@ def edit_student(student_id):
 @app.route('/upload_document/<student_id>', methods=['POST'])
 @login_required()
 def upload_document(student_id):
+    # Verify student exists and user has permission before touching the upload
+    conn = get_db_connection()
+    if not student_in_scope(conn, student_id):
+        conn.close()
+        abort(403)
+    
     if 'document' not in request.files:
+        conn.close()
         flash('No file selected', 'danger')
         return redirect(url_for('search_student'))
     
@@ -429,29 +1442,8 @@ def upload_document(student_id):
     document_name = request.form.get('document_name', 'Unnamed Document')
     
     if document and allowed_file(document.filename):
-        filename = secure_filename(f"{student_id}_{document_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{document.filename.rsplit('.', 1)[1].lower()}")
-        document_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        document.save(document_path)
-        
-        conn = get_db_connection()
-        
-        # Verify student exists and user has permission
-        query = 'SELECT 1 FROM students WHERE student_id = ?'
-        params = (student_id,)
-        
-        if session['role'] == 'school':
-            query += ' AND school = ?'
-            params += (session['school'],)
-        elif session['role'] == 'department':
-            query += ' AND department = ?'
-            params += (session['department'],)
-        
-        student_exists = conn.execute(query, params).fetchone()
-        
-        if not student_exists:
-            conn.close()
-            os.remove(document_path)  # Clean up uploaded file
-            abort(403)
+        filename = get_blob_store().save(conn, document.stream, file_extension(document.filename))
+        queue_thumbnail(conn, filename)
         
         # Insert document record
         conn.execute('''
@@ -460,76 +1452,288 @@ def upload_document(student_id):
         ''', (student_id, document_name, filename))
         
         conn.commit()
-        conn.close()
+        get_authorizer().invalidate_file(filename)
+        wake_job_workers()
         
         flash('Document uploaded successfully!', 'success')
     else:
         flash('Invalid file type', 'danger')
     
+    conn.close()
     return redirect(url_for('search_student', student_id=student_id))
 
-@app.route('/download/<filename>')
+def partial_upload_path(upload_id):
+    return os.path.join(app.config['UPLOAD_FOLDER'], '.partial', upload_id)
+
+def get_upload_session(conn, upload_id):
+    upload = conn.execute('SELECT * FROM upload_sessions WHERE id = ? AND username = ?',
+                          (upload_id, session['username'])).fetchone()
+    if not upload:
+        conn.close()
+        abort(404)
+    if not student_in_scope(conn, upload['student_id']):
+        conn.close()
+        abort(403)
+    return upload
+
+def delete_upload_session(conn, upload_id):
+    conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+    conn.commit()
+    try:
+        os.remove(partial_upload_path(upload_id))
+    except OSError:
+        pass
+
+@app.route('/api/uploads', methods=['POST'])
 @login_required()
-def download_file(filename):
-    # Verify the user has permission to access this file
-    student_id = filename.split('_')[0]
-    
-    conn = get_db_connection()
+def create_upload():
+    # Starts a resumable upload. Only the small JSON/form body is read here;
+    # the file itself arrives in PUT /api/uploads/<id> chunks.
+    data = request.get_json(silent=True) or request.form
+    student_id = data.get('student_id', '')
+    document_name = data.get('document_name') or 'Unnamed Document'
+    filename = data.get('filename', '')
+    try:
+        size = int(data.get('size', 0))
+    except (TypeError, ValueError):
+        size = 0
     
-    query = 'SELECT 1 FROM students WHERE student_id = ?'
-    params = (student_id,)
+    if not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type'}), 415
+    if size <= 0 or size > app.config['MAX_UPLOAD_SIZE']:
+        return jsonify({'error': 'Invalid file size'}), 413
     
-    if session['role'] == 'school':
-        query += ' AND school = ?'
-        params += (session['school'],)
-    elif session['role'] == 'department':
-        query += ' AND department = ?'
-        params += (session['department'],)
+    conn = get_db_connection()
+    if not student_in_scope(conn, student_id):
+        conn.close()
+        abort(403)
     
-    student_exists = conn.execute(query, params).fetchone()
+    upload_id = secrets.token_urlsafe(24)
+    conn.execute('''
+        INSERT INTO upload_sessions (id, student_id, document_name, ext, size, username)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (upload_id, student_id, document_name, file_extension(filename), size, session['username']))
+    conn.commit()
     conn.close()
     
-    if not student_exists:
-        abort(403)
+    os.makedirs(os.path.dirname(partial_upload_path(upload_id)), exist_ok=True)
+    open(partial_upload_path(upload_id), 'wb').close()
     
-    try:
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
-    except FileNotFoundError:
-        abort(404)
+    return jsonify({'upload_id': upload_id, 'offset': 0, 'size': size,
+                    'chunk_size': app.config['UPLOAD_CHUNK_SIZE']}), 201
 
-@app.route('/view_document/<filename>')
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
 @login_required()
-def view_document(filename):
-    # Similar permission check as download
-    student_id = filename.split('_')[0]
-    
+def upload_status(upload_id):
+    # Clients resume from the returned offset after a dropped connection
+    conn = get_db_connection()
+    upload = get_upload_session(conn, upload_id)
+    conn.close()
+    return jsonify({'upload_id': upload_id, 'offset': upload['received'], 'size': upload['size']})
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required()
+def cancel_upload(upload_id):
+    conn = get_db_connection()
+    get_upload_session(conn, upload_id)
+    delete_upload_session(conn, upload_id)
+    conn.close()
+    return '', 204
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+@login_required()
+def upload_chunk(upload_id):
+    # Appends one chunk at the offset given by the Upload-Offset header (or a
+    # Content-Range of "bytes <start>-<end>/<total>"). The request body is
+    # streamed straight to the partial file, never parsed as a form.
     conn = get_db_connection()
+    upload = get_upload_session(conn, upload_id)
     
-    query = 'SELECT 1 FROM students WHERE student_id = ?'
-    params = (student_id,)
+    offset = request.headers.get('Upload-Offset')
+    if offset is None:
+        match = re.match(r'bytes (\d+)-\d+/\d+$', request.headers.get('Content-Range', ''))
+        offset = match.group(1) if match else None
+    if offset is None or not offset.isdigit():
+        conn.close()
+        return jsonify({'error': 'Missing Upload-Offset'}), 400
+    offset = int(offset)
+    if offset != upload['received']:
+        conn.close()
+        return jsonify({'error': 'Offset mismatch', 'offset': upload['received']}), 409
     
-    if session['role'] == 'school':
-        query += ' AND school = ?'
-        params += (session['school'],)
-    elif session['role'] == 'department':
-        query += ' AND department = ?'
-        params += (session['department'],)
+    length = request.content_length
+    if length is not None and length > app.config['MAX_CONTENT_LENGTH']:
+        conn.close()
+        return jsonify({'error': 'Chunk larger than MAX_CONTENT_LENGTH', 'offset': upload['received']}), 413
+    if length is None or offset + length > upload['size']:
+        conn.close()
+        return jsonify({'error': 'Chunk exceeds declared size', 'offset': upload['received']}), 413
+    
+    stream = request.stream
+    if offset == 0:
+        # Reject files whose content does not match their extension before
+        # anything is stored
+        head = stream.read(min(length, 16))
+        if not matches_magic(upload['ext'], head):
+            delete_upload_session(conn, upload_id)
+            conn.close()
+            return jsonify({'error': 'File content does not match its type'}), 415
+    else:
+        head = b''
     
-    student_exists = conn.execute(query, params).fetchone()
+    # The body is received into a file of its own. It is copied into the
+    # partial file only under the database write lock, and only if the
+    # upload is still at offset then, so a retry and the PUT it replaced
+    # (still streaming after a dropped connection) never both write to it.
+    tmp_dir = os.path.join(app.config['UPLOAD_FOLDER'], '.tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, chunk_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        written = len(head)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(head)
+            while written < length:
+                chunk = stream.read(min(64 * 1024, length - written))
+                if not chunk:
+                    break
+                f.write(chunk)
+                written += len(chunk)
+        
+        received = offset + written
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT received FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+            if row is None or row[0] != offset:
+                conn.rollback()
+                conn.close()
+                return jsonify({'error': 'Concurrent chunk for this upload'}), 409
+            with open(chunk_path, 'rb') as src, open(partial_upload_path(upload_id), 'r+b') as f:
+                f.seek(offset)
+                shutil.copyfileobj(src, f, 64 * 1024)
+                f.truncate(received)
+            conn.execute('UPDATE upload_sessions SET received = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                         (received, upload_id))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    finally:
+        os.remove(chunk_path)
+    
+    if received < upload['size']:
+        conn.close()
+        return jsonify({'upload_id': upload_id, 'offset': received, 'size': upload['size']})
+    
+    # Last chunk: move the file into content-addressed storage
+    store = get_blob_store()
+    tmp_path = partial_upload_path(upload_id)
+    document_path = store.adopt(conn, tmp_path, file_sha256(tmp_path), received, upload['ext'])
+    queue_thumbnail(conn, document_path)
+    cursor = conn.execute('''
+        INSERT INTO documents (student_id, document_name, document_path)
+        VALUES (?, ?, ?)
+    ''', (upload['student_id'], upload['document_name'], document_path))
+    conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+    conn.commit()
     conn.close()
+    get_authorizer().invalidate_file(document_path)
+    wake_job_workers()
     
-    if not student_exists:
+    return jsonify({'document_id': cursor.lastrowid, 'document_path': document_path,
+                    'offset': received, 'size': upload['size']}), 201
+
+def authorize_file(filename):
+    # The file must belong to a document or photo of a student in scope
+    conn = get_db_connection()
+    authorizer = get_authorizer()
+    if not authorizer.file_owners(conn, filename):
+        conn.close()
+        abort(404)
+    allowed = authorizer.can_access_file(conn, session['role'], session.get('school'),
+                                         session.get('department'), filename)
+    conn.close()
+    if not allowed:
         abort(403)
+
+def document_download_name(filename):
+    # Stored names are content hashes; offer the student and document name
+    conn = get_db_connection()
+    document = conn.execute(queries.DOCUMENT_BY_PATH, (filename,)).fetchone()
+    conn.close()
+    if not document:
+        return None
+    return secure_filename(f"{document['student_id']}_{document['document_name']}.{file_extension(filename)}")
+
+def serve_upload(filename, as_attachment=False, download_name=None):
+    # Uploads are private, so only the browser may cache them. The internal
+    # path answers If-None-Match with 304 and Range with 206 through
+    # send_file(conditional=True); Werkzeug's ETag is a strong validator
+    # built from the file's mtime, size and name.
+    folder = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    
+    # A content-addressed file never changes, its hash is the ETag
+    digest = blob_digest(filename)
+    max_age = app.config['UPLOAD_IMMUTABLE_MAX_AGE'] if digest else app.config['UPLOAD_MAX_AGE']
+    
+    mode = app.config['UPLOAD_SERVE_MODE']
+    if mode == 'internal':
+        response = send_file(path, as_attachment=as_attachment, download_name=download_name,
+                             conditional=True, etag=digest or True, max_age=max_age)
+    else:
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        if mode == 'x-accel-redirect':
+            response.headers['X-Accel-Redirect'] = app.config['UPLOAD_X_ACCEL_PREFIX'] + quote(filename)
+        elif mode == 'x-sendfile':
+            response.headers['X-Sendfile'] = path
+        else:
+            raise ValueError(f'Unknown UPLOAD_SERVE_MODE: {mode}')
+        if as_attachment:
+            response.headers.set('Content-Disposition', 'attachment',
+                                 filename=download_name or os.path.basename(filename))
+        response.cache_control.max_age = max_age
+    
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = bool(digest)
+    return response
+
+@app.route('/download/<path:filename>')
+@login_required()
+def download_file(filename):
+    # Verify the user has permission to access this file
+    authorize_file(filename)
+    return serve_upload(filename, as_attachment=True, download_name=document_download_name(filename))
+
+@app.route('/view_document/<path:filename>')
+@login_required()
+def view_document(filename):
+    # Same permission check as download
+    authorize_file(filename)
     
     # Only allow viewing of certain file types
-    ext = filename.rsplit('.', 1)[1].lower()
+    ext = filename.rsplit('.', 1)[-1].lower()
     if ext not in ['png', 'jpg', 'jpeg', 'gif', 'pdf']:
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+        return serve_upload(filename, as_attachment=True, download_name=document_download_name(filename))
     
-    try:
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
-    except FileNotFoundError:
-        abort(404)
+    return serve_upload(filename)
+
+def generated_thumbnail(filename):
+    # The stored thumbnail/preview of filename, if its job has produced one
+    thumb = thumbnail_path(filename, thumbnail_format(app.config['THUMBNAIL_FORMAT']))
+    if os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], *thumb.split('/'))):
+        return thumb
+    return None
+
+@app.route('/thumbnail/<path:filename>')
+@login_required()
+def thumbnail(filename):
+    # Serves the generated thumbnail/preview, or the original until the
+    # background job has produced one
+    authorize_file(filename)
+    return serve_upload(generated_thumbnail(filename) or filename)
 
 @app.route('/delete_document/<int:doc_id>', methods=['POST'])
 @login_required()
@@ -537,43 +1741,228 @@ def delete_document(doc_id):
     conn = get_db_connection()
     
     # Get document info
-    document = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,)).fetchone()
+    document = conn.execute(queries.DOCUMENT, (doc_id,)).fetchone()
     
     if not document:
         conn.close()
         abort(404)
     
     # Verify user has permission to delete this document
-    query = 'SELECT 1 FROM students WHERE student_id = ?'
-    params = (document['student_id'],)
-    
-    if session['role'] == 'school':
-        query += ' AND school = ?'
-        params += (session['school'],)
-    elif session['role'] == 'department':
-        query += ' AND department = ?'
-        params += (session['department'],)
-    
-    student_exists = conn.execute(query, params).fetchone()
-    
-    if not student_exists:
+    if not student_in_scope(conn, document['student_id']):
         conn.close()
         abort(403)
     
-    # Delete file from filesystem
-    try:
-        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], document['document_path']))
-    except OSError:
-        pass
-    
-    # Delete record from database
+    # Delete record from database, and the file once nothing references it
+    store = get_blob_store()
     conn.execute('DELETE FROM documents WHERE id = ?', (doc_id,))
+    unused = store.release(conn, document['document_path'])
     conn.commit()
+    if unused:
+        store.discard(conn, document['document_path'])
     conn.close()
+    get_authorizer().invalidate_file(document['document_path'])
     
     flash('Document deleted successfully', 'success')
     return redirect(url_for('search_student', student_id=document['student_id']))
 
+@app.route('/api/db_stats')
+@login_required('super_admin')
+def db_stats():
+    stats = get_pool().stats()
+    stats['read_pool'] = get_read_pool().stats()
+    stats['replicas'] = [replica.stats() for replica in get_replicas()]
+    stats['maintenance'] = maintenance_status(get_db_connection())
+    return jsonify(stats)
+
+@app.route('/api/cache_stats')
+@login_required('super_admin')
+def cache_stats():
+    return jsonify({'stats': get_stats_cache().stats(), 'authz': get_authorizer().stats(),
+                    'sessions': get_session_store().stats()})
+
+@app.route('/api/sessions/revoke', methods=['POST'])
+@login_required('super_admin')
+def revoke_sessions():
+    # Logs a user out everywhere; other workers notice within SESSION_LOCAL_TTL
+    username = ((request.get_json(silent=True) or request.form).get('username') or '').strip()
+    if not username:
+        return jsonify({'error': 'Username is required'}), 400
+    return jsonify({'username': username, 'revoked': get_session_store().delete_user(username)})
+
+@app.route('/metrics')
+def metrics():
+    # Unauthenticated for the Prometheus scraper, so only served when
+    # METRICS_ENABLED is set; restrict access to it at the front-end server
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+    gauges = stats_gauges('db_pool', 'Connection pool', get_pool().stats())
+    gauges += stats_gauges('stats_cache', 'Dashboard and stats cache', get_stats_cache().stats())
+    gauges += stats_gauges('authz_cache', 'Authorization cache', get_authorizer().stats())
+    gauges += stats_gauges('sessions', 'Session store', get_session_store().stats())
+    gauges += stats_gauges('db_read_pool', 'Read-only connection pool', get_read_pool().stats())
+    lags = {(('replica', replica.path),): replica.lag() for replica in get_replicas()}
+    gauges.append(('db_replica_lag_seconds', 'Seconds since the replica last matched the primary',
+                   {labels: lag for labels, lag in lags.items() if lag is not None}))
+    return Response(get_metrics().render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Create the tables and apply pending schema migrations."""
+    applied = migrate_db()
+    click.echo(f"Applied migration(s) {', '.join(map(str, applied))}" if applied else 'Schema is up to date')
+
+@app.cli.command('seed')
+def seed_command():
+    """Add the default admin accounts, and sample students to an empty database."""
+    migrate_db()
+    click.echo(f'Added {seed_db()} admin account(s)')
+
+@app.cli.command('check-query-plans')
+def check_query_plans():
+    """Fail if any route query falls back to a full table scan."""
+    migrate_db()
+    conn = sqlite3.connect(app.config['DATABASE'])
+    failures = 0
+    for name, scans, allowed in queries.check_query_plans(conn):
+        if scans and not allowed:
+            failures += 1
+            click.echo(f'FAIL {name}: ' + '; '.join(scans))
+        else:
+            click.echo(f'ok   {name}')
+    conn.close()
+    if failures:
+        raise SystemExit(1)
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats():
+    """Recompute the student_counts summary table from students."""
+    migrate_db()
+    conn = sqlite3.connect(app.config['DATABASE'])
+    drift = rebuild_student_counts(conn)
+    conn.close()
+    for school, department, stored, actual in drift:
+        click.echo(f'{school} / {department}: {stored} -> {actual}')
+    click.echo(f'student_counts rebuilt, {len(drift)} row(s) corrected')
+
+@app.cli.command('refresh-replicas')
+@click.option('--interval', type=float, default=None, help='Seconds between refreshes [default: REPLICA_REFRESH_INTERVAL]')
+@click.option('--once', is_flag=True, help='Refresh every replica once and exit')
+def refresh_replicas(interval, once):
+    """Copy the primary database into the DATABASE_REPLICAS files."""
+    migrate_db()
+    interval = interval or app.config['REPLICA_REFRESH_INTERVAL'] or 5.0
+    replicas = [Replica(app.config['DATABASE'], path) for path in app.config['DATABASE_REPLICAS']]
+    if not replicas:
+        raise click.ClickException('DATABASE_REPLICAS is empty')
+    while True:
+        for replica in replicas:
+            if replica.refresh():
+                click.echo(f'{replica.path}: refreshed in {replica.last_duration:.3f}s')
+        if once:
+            break
+        time.sleep(interval)
+
+@app.cli.group()
+def maintenance():
+    """Upload garbage collection and database upkeep."""
+
+@maintenance.command('run')
+@click.argument('task', type=click.Choice(sorted(MAINTENANCE_TASKS)))
+@click.option('--dry-run', is_flag=True, help='Report what would be removed without removing it')
+@click.option('--fix', is_flag=True, help='check_references: delete rows whose file is missing')
+@click.option('--throttle', type=float, default=None, help='Seconds between steps [default: MAINTENANCE_THROTTLE]')
+def maintenance_run(task, dry_run, fix, throttle):
+    """Run one maintenance task to completion now."""
+    migrate_db()
+    conn = sqlite3.connect(app.config['DATABASE'], timeout=30)
+    state = run_task(conn, task, maintenance_options(dry_run=dry_run, fix=fix),
+                     throttle=app.config['MAINTENANCE_THROTTLE'] if throttle is None else throttle)
+    conn.close()
+    state.pop('cursor', None)
+    state.pop('table', None)
+    state.pop('started', None)
+    click.echo(f"{task}{' (dry run)' if dry_run else ''}: {json.dumps(state)}")
+
+@maintenance.command('schedule')
+def maintenance_schedule():
+    """Queue maintenance tasks as they fall due; run `flask run-jobs` to process them."""
+    migrate_db()
+    get_maintenance_scheduler().start()
+    click.echo('Queueing maintenance tasks as they fall due, Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+@maintenance.command('status')
+def maintenance_show_status():
+    """Show when each maintenance task last ran and its result."""
+    migrate_db()
+    conn = sqlite3.connect(app.config['DATABASE'])
+    for run in maintenance_status(conn):
+        finished = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run['finished_at'])) if run['finished_at'] else 'never'
+        click.echo(f"{run['task']:<18} {finished}  {json.dumps(run['result'])}")
+    conn.close()
+
+@maintenance.command('vacuum-full')
+def maintenance_vacuum_full():
+    """Rebuild the database file once and enable incremental vacuum.
+
+    Writers are blocked while it runs, so use a quiet period."""
+    migrate_db()
+    conn = sqlite3.connect(app.config['DATABASE'], timeout=30)
+    before = os.path.getsize(app.config['DATABASE'])
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    conn.close()
+    click.echo(f"{before} -> {os.path.getsize(app.config['DATABASE'])} bytes, auto_vacuum=INCREMENTAL")
+
+@app.cli.command('run-jobs')
+@click.option('--workers', default=2, show_default=True)
+@click.option('--once', is_flag=True, help='Drain the queue and exit instead of waiting for new jobs')
+def run_jobs(workers, once):
+    """Process queued background jobs (thumbnails, previews)."""
+    migrate_db()
+    conn = sqlite3.connect(app.config['DATABASE'])
+    requeued = requeue_stale(conn)
+    if requeued:
+        click.echo(f'Requeued {requeued} stale job(s)')
+    pool = get_job_workers(workers)
+    if once:
+        while pool.run_once(conn):
+            pass
+        click.echo(f'Queue: {queue_stats(conn)}')
+        conn.close()
+        return
+    conn.close()
+    pool.start()
+    click.echo(f'Processing jobs with {workers} worker(s), Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pool.stop()
+
+@app.cli.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension')
+def import_students_command(path, fmt):
+    """Bulk import students from a CSV or JSONL file."""
+    migrate_db()
+    conn = sqlite3.connect(app.config['DATABASE'])
+    with open(path, 'rb') as f:
+        rows = clean_records(read_records(f, fmt or detect_format(path)), 'super_admin')
+        report = import_students(conn, rows, get_catalog().pairs(conn), allow_new_pairs=True,
+                                 batch_size=app.config['IMPORT_BATCH_SIZE'])
+    record_imported_departments(conn, report.pop('touched'))
+    conn.close()
+    for error in report['errors']:
+        click.echo(f"line {error['line']}: {error['student_id'] or '-'}: {error['error']}")
+    if report['errors_truncated']:
+        click.echo('... more errors not shown')
+    click.echo(f"Imported {report['imported']} student(s), {report['failed']} failed")
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
@@ -583,5 +1972,6 @@ def forbidden(e):
     return render_template('403.html'), 403
 
 if __name__ == '__main__':
+    init_db()
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,86 @@
+import csv
+import io
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _Sink:
+    # Write-only file object for zipfile. It has no tell() or seek(), so
+    # zipfile streams each entry with a data descriptor after its data and
+    # never goes back to patch a header; drain() hands out what was written.
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(entries, compression=zipfile.ZIP_STORED):
+    # Yields a zip64 archive of entries, (name, date_time, chunks) tuples with
+    # chunks an iterable of bytes, while it is being built. Only the current
+    # chunk and the central directory (about 100 bytes per entry) are kept
+    # in memory.
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=compression, allowZip64=True) as archive:
+        for name, date_time, chunks in entries:
+            info = zipfile.ZipInfo(name, date_time=date_time)
+            info.compress_type = compression
+            with archive.open(info, 'w', force_zip64=True) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+def iter_file(path, chunk_size=CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+
+
+def iter_csv(header, rows, chunk_size=CHUNK_SIZE):
+    # Encodes rows as CSV in chunks of about chunk_size bytes rather than a
+    # line at a time, so that each write to the client is worth it. The byte
+    # order mark lets Excel detect UTF-8.
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue().encode('utf-8-sig')
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def zip_date_time(timestamp):
+    # 'YYYY-MM-DD HH:MM:SS' from SQLite to a zip date; zip cannot store dates
+    # before 1980
+    try:
+        date_time = tuple(int(part) for part in
+                          timestamp[:19].replace('T', ' ').replace('-', ' ').replace(':', ' ').split())
+    except (TypeError, ValueError):
+        return (1980, 1, 1, 0, 0, 0)
+    if len(date_time) != 6 or date_time[0] < 1980:
+        return (1980, 1, 1, 0, 0, 0)
+    return date_time
@@ -0,0 +1,251 @@
+# ASGI entry point, e.g. `uvicorn asgi:application --workers 4`.
+#
+# A slow client costs an open connection here, not a thread. The request
+# body is received on the event loop, spooled to a temporary file past
+# ASGI_SPOOL_SIZE, and only then does the unchanged Flask app handle the
+# request, in a pool of ASGI_THREADS threads where all SQLite access happens.
+# The response goes back a chunk at a time, each read or generated in the
+# pool and sent from the event loop, so downloads and exports give their
+# thread back while they wait on the client. A view that waits between
+# chunks, such as the /api/changes long poll and event stream, yields
+# app.Pause and the wait happens on the event loop too.
+import asyncio
+import contextvars
+import logging
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.wsgi import FileWrapper
+
+from app import Pause, create_app
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkedFileWrapper(FileWrapper):
+    # wsgi.file_wrapper for send_file(); werkzeug asks for 8KB reads, which
+    # would cost a trip to the thread pool each
+    chunk_size = 64 * 1024
+
+    def __init__(self, file, buffer_size=8192):
+        super().__init__(file, max(buffer_size, self.chunk_size))
+
+
+class RequestTooLarge(Exception):
+    pass
+
+
+class ASGIAdapter:
+    def __init__(self, wsgi_app, threads=16, spool_size=1024 * 1024, max_body_size=None):
+        self.wsgi_app = wsgi_app
+        self.threads = threads
+        self.spool_size = spool_size
+        self.max_body_size = max_body_size
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='asgi')
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+        else:
+            # No websocket routes
+            await receive()
+            await send({'type': 'websocket.close'})
+
+    async def handle_lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                    self._executor = None
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle_http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        # Every call for one request runs in the same context, so a streamed
+        # response generated under stream_with_context() still finds its
+        # request context when the next chunk is produced on another thread
+        context = contextvars.copy_context()
+        current = []
+
+        async def run(function, *args):
+            # One call at a time: a context can only be entered by one thread.
+            # If the request is cancelled while a call is in the pool, that
+            # call runs on, shielded, and the close() calls on the way out
+            # wait for it instead of failing to enter the context.
+            if current and not current[0].done():
+                await asyncio.wait(current)
+            current[:] = [loop.run_in_executor(self.executor, context.run, function, *args)]
+            return await asyncio.shield(current[0])
+
+        try:
+            body = await self.read_body(scope, receive, run)
+        except RequestTooLarge:
+            await send_error(send, 413, b'Request Entity Too Large')
+            return
+        if body is None:
+            return
+
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = loop.create_task(watch_disconnect())
+        try:
+            await self.respond(scope, body, send, run, disconnected)
+        finally:
+            watcher.cancel()
+            await run(body.close)
+
+    async def read_body(self, scope, receive, run):
+        # The whole body is received before the view runs, in memory up to
+        # spool_size and in a temporary file beyond that. None means the
+        # client went away before sending all of it.
+        for name, value in scope.get('headers', []):
+            if name == b'content-length' and self.max_body_size is not None and value.isdigit() \
+                    and int(value) > self.max_body_size:
+                raise RequestTooLarge()
+        body = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        size = 0
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    body.close()
+                    return None
+                chunk = message.get('body', b'')
+                if chunk:
+                    size += len(chunk)
+                    if self.max_body_size is not None and size > self.max_body_size:
+                        raise RequestTooLarge()
+                    if size > self.spool_size:
+                        await run(body.write, chunk)
+                    else:
+                        body.write(chunk)
+                if not message.get('more_body', False):
+                    break
+        except BaseException:
+            body.close()
+            raise
+        body.seek(0)
+        return body
+
+    async def respond(self, scope, body, send, run, disconnected):
+        environ = build_environ(scope, body)
+        started = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers]
+            return written.append
+
+        try:
+            iterable = await run(self.wsgi_app, environ, start_response)
+            iterator = iter(iterable)
+        except Exception:
+            logger.exception('Unhandled error in %s %s', scope['method'], scope['path'])
+            await send_error(send, 500, b'Internal Server Error')
+            return
+        try:
+            # The first chunk is produced before the headers go out, the way a
+            # WSGI server does it, so a generator may still call start_response
+            try:
+                chunk = await run(next, iterator, None)
+            except Exception:
+                logger.exception('Unhandled error in %s %s', scope['method'], scope['path'])
+                await send_error(send, 500, b'Internal Server Error')
+                return
+            started['sent'] = True
+            await send({'type': 'http.response.start', 'status': started['status'],
+                        'headers': started['headers']})
+            for data in written:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+            while chunk is not None and not disconnected.is_set():
+                if isinstance(chunk, Pause):
+                    try:
+                        await asyncio.wait_for(disconnected.wait(), chunk.seconds)
+                    except asyncio.TimeoutError:
+                        pass
+                elif chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await run(next, iterator, None)
+            if not disconnected.is_set():
+                await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(iterable, 'close'):
+                await run(iterable.close)
+
+
+def build_environ(scope, body):
+    # PEP 3333 environ for an ASGI HTTP scope
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]) if server[1] is not None else '80',
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': ChunkedFileWrapper,
+        'asgi.scope': scope,
+        'student_mgmt.pause': True,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+        environ['REMOTE_PORT'] = str(scope['client'][1])
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+            key = name
+        else:
+            key = 'HTTP_' + name
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    body.seek(0, 2)
+    environ['CONTENT_LENGTH'] = str(body.tell())
+    body.seek(0)
+    return environ
+
+
+async def send_error(send, status, message):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(message)).encode())]})
+    await send({'type': 'http.response.body', 'body': message})
+
+
+app = create_app()
+application = ASGIAdapter(app, threads=app.config['ASGI_THREADS'], spool_size=app.config['ASGI_SPOOL_SIZE'],
+                          max_body_size=app.config['MAX_CONTENT_LENGTH'])
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+import queries
+
+
+class _LRU:
+    # ttl=None keeps entries until they are evicted or popped
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            expires = time.monotonic() + self.ttl if self.ttl is not None else None
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def scope_allows(role, school, department, student_scope):
+    # Same rules the routes used to express as extra WHERE clauses
+    student_school, student_department = student_scope
+    if role == 'super_admin':
+        return True
+    if role == 'school':
+        return student_school == school
+    if role == 'department':
+        return student_department == department
+    return False
+
+
+class ScopeAuthorizer:
+    # Answers "may this session touch this student / file?" from two small
+    # per-process LRUs: student_id -> (school, department) and
+    # file path -> owning student_ids. Only rows that exist are cached, so a
+    # student or document created by another worker is never hidden. Owners
+    # expire after file_ttl seconds, so a document or photo removed by
+    # another worker stops granting access after at most that long.
+    def __init__(self, maxsize=4096, file_ttl=30):
+        self._students = _LRU(maxsize)
+        self._files = _LRU(maxsize, ttl=file_ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def student_scope(self, conn, student_id):
+        scope = self._students.get(student_id)
+        self._count(scope is not None)
+        if scope is None:
+            row = conn.execute(queries.STUDENT_SCOPE, (student_id,)).fetchone()
+            if row is None:
+                return None
+            scope = (row[0], row[1])
+            self._students.set(student_id, scope)
+        return scope
+
+    def file_owners(self, conn, path, cached=True):
+        # A stored file belongs to the students whose documents or photo
+        # reference it. cached=False reads them again, for a denial: another
+        # worker may have given the file to one more student since.
+        owners = self._files.get(path) if cached else None
+        if cached:
+            self._count(owners is not None)
+        if owners is None:
+            rows = conn.execute(queries.FILE_OWNERS, (path, path)).fetchall()
+            if not rows:
+                return ()
+            owners = tuple(row[0] for row in rows)
+            self._files.set(path, owners)
+        return owners
+
+    def can_access_student(self, conn, role, school, department, student_id):
+        scope = self.student_scope(conn, student_id)
+        return scope is not None and scope_allows(role, school, department, scope)
+
+    def can_access_file(self, conn, role, school, department, path):
+        # Refused only on the owners as they are now, not as cached
+        for cached in (True, False):
+            if any(self.can_access_student(conn, role, school, department, owner)
+                   for owner in self.file_owners(conn, path, cached)):
+                return True
+        return False
+
+    def invalidate_student(self, student_id):
+        self._students.pop(student_id)
+
+    def invalidate_file(self, path):
+        self._files.pop(path)
+
+    def clear(self):
+        self._students.clear()
+        self._files.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'students': len(self._students),
+                'files': len(self._files),
+            }
@@ -0,0 +1,159 @@
+"""Synthetic large-campus dataset for the benchmarks.
+
+    python benchmarks/generate_campus.py --dir /tmp/campus --schools 20 --departments 10 --students 1000000
+
+Creates <dir>/database.db and <dir>/static/uploads laid out the way app.py
+expects them, then adds schools x departments with an admin account each,
+students spread over the last four years and documents that point at a pool
+of real files, so downloads can be timed as well. The parameters and the
+admin logins are written to <dir>/campus.json for benchmarks/load_test.py.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SYLLABLES = ['an', 'ar', 'vi', 'ka', 'ra', 'ma', 'ni', 'sh', 'pr', 'ja', 'de', 'li', 'su', 'ro', 'ta',
+             'mi', 'na', 'ha', 'ke', 'lo', 'be', 'ch', 'di', 'ga', 'ya', 'th', 'el', 'os', 'ur', 'in']
+DOCUMENT_NAMES = ['transcript.pdf', 'id_proof.pdf', 'admission_form.pdf', 'fee_receipt.pdf',
+                  'marksheet.pdf', 'transfer_certificate.pdf', 'medical_certificate.pdf']
+FOUR_YEARS = 4 * 365 * 24 * 60 * 60
+
+
+def make_name(rng):
+    return ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))).capitalize()
+
+
+def school_name(i):
+    return f'School {i + 1:02d}'
+
+
+def department_name(i, j):
+    # Department admins are scoped by department name alone, so names have
+    # to be unique across schools
+    return f'S{i + 1:02d} Department {j + 1:02d}'
+
+
+def timestamp(seconds):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+
+
+def create_files(conn, store, count, size, rng):
+    paths = []
+    for _ in range(count):
+        content = b'%PDF-1.4\n' + rng.randbytes(size)
+        paths.append(store.save(conn, io.BytesIO(content), 'pdf'))
+    return paths
+
+
+def fill(conn, args, pairs, paths, rng):
+    start = conn.execute('SELECT COALESCE(MAX(id), 0) FROM students').fetchone()[0]
+    now = time.time()
+    documents_total = 0
+    for offset in range(0, args.students, args.batch):
+        students = []
+        documents = []
+        for i in range(start + offset, start + min(offset + args.batch, args.students)):
+            student_id = f'C{i:08d}'
+            first, last = make_name(rng), make_name(rng)
+            school, department = rng.choice(pairs)
+            created = now - rng.random() * FOUR_YEARS
+            students.append((student_id, f'{first} {last}', f'{first.lower()}.{last.lower()}{i}@example.com',
+                             f'{rng.randrange(10**9, 10**10)}', department, school, timestamp(created)))
+            count = int(args.documents) + (rng.random() < args.documents - int(args.documents))
+            for name in rng.sample(DOCUMENT_NAMES, min(count, len(DOCUMENT_NAMES))):
+                documents.append((student_id, name, rng.choice(paths),
+                                  timestamp(created + rng.random() * (now - created))))
+        # Documents go in first so that the search index picks them up when
+        # the student row is inserted, instead of being rebuilt per document
+        with conn:
+            conn.executemany('INSERT INTO documents (student_id, document_name, document_path, upload_date) '
+                             'VALUES (?, ?, ?, ?)', documents)
+            conn.executemany('INSERT INTO students (student_id, name, email, phone, department, school, created_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)', students)
+        documents_total += len(documents)
+        print(f'  {offset + len(students)}/{args.students} students', end='\r', flush=True)
+    print()
+    return documents_total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', required=True, help='Directory for database.db and static/uploads')
+    parser.add_argument('--schools', type=int, default=10)
+    parser.add_argument('--departments', type=int, default=8, help='Departments per school')
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--documents', type=float, default=1.5, help='Average documents per student')
+    parser.add_argument('--files', type=int, default=64, help='Distinct files the documents point at')
+    parser.add_argument('--file-size', type=int, default=200 * 1024)
+    parser.add_argument('--password', default='bench123', help='Password of the generated admin accounts')
+    parser.add_argument('--batch', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.join(args.dir, 'static', 'uploads'), exist_ok=True)
+    # database.db and the other files in the default config are relative to
+    # the working directory
+    os.chdir(args.dir)
+    from app import create_app, get_password_policy, init_db
+    app = create_app()
+    init_db()
+    from catalog import add_departments
+    from storage import BlobStore
+
+    rng = random.Random(args.seed)
+    pairs = [(school_name(i), department_name(i, j)) for i in range(args.schools) for j in range(args.departments)]
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    started = time.perf_counter()
+
+    # One hash for every generated admin; they all share the same password
+    password = get_password_policy().hash(args.password)
+    users = [(f'school{i + 1:02d}_admin', 'school', school_name(i), None) for i in range(args.schools)]
+    users += [(f's{i + 1:02d}_d{j + 1:02d}_admin', 'department', school_name(i), department_name(i, j))
+              for i in range(args.schools) for j in range(args.departments)]
+    with conn:
+        add_departments(conn, pairs)
+        conn.executemany('INSERT OR IGNORE INTO users (username, password, role, school, department) '
+                         'VALUES (?, ?, ?, ?, ?)', [(u, password, r, s, d) for u, r, s, d in users])
+        paths = create_files(conn, BlobStore(os.path.abspath(app.config['UPLOAD_FOLDER'])),
+                             args.files, args.file_size, rng)
+
+    documents = fill(conn, args, pairs, paths, rng)
+    with conn:
+        conn.execute('UPDATE blobs SET refcount = (SELECT COUNT(*) FROM documents WHERE document_path = blobs.path)')
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA optimize')
+    conn.close()
+    elapsed = time.perf_counter() - started
+
+    manifest = {
+        'schools': args.schools,
+        'departments': args.departments,
+        'students': args.students,
+        'documents': documents,
+        'files': args.files,
+        'file_size': args.file_size,
+        'seed': args.seed,
+        'logins': {
+            'super_admin': ['superadmin', 'superadmin123'],
+            'school': [users[0][0], args.password],
+            'department': [users[args.schools][0], args.password],
+        },
+    }
+    with open('campus.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f'{args.students} students and {documents} documents in {len(pairs)} departments '
+          f'generated in {elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
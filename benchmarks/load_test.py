@@ -0,0 +1,328 @@
+"""Per-route latency and throughput against a generated campus dataset.
+
+    python benchmarks/generate_campus.py --dir /tmp/campus --students 1000000
+    python benchmarks/load_test.py --dir /tmp/campus --output before.json
+    python benchmarks/load_test.py --dir /tmp/campus --mode server --workers 4 --concurrency 16 \\
+        --output after.json --compare before.json
+
+--mode client drives the app in-process through the Flask test client, one
+request at a time. --mode server starts a local pre-forked server with
+--workers processes on a shared socket and sends requests from
+--concurrency threads. Both log in as a super admin, a school admin and a
+department admin and report p50/p99 latency and throughput per role and
+route; --output saves them as JSON and --compare prints the change against
+an earlier run.
+"""
+import argparse
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import quote, urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_LOGINS = {
+    'super_admin': ['superadmin', 'superadmin123'],
+    'school': ['eng_admin', 'admin123'],
+    'department': ['cse_admin', 'admin123'],
+}
+
+
+def load_samples(database, role_scopes, count, seed):
+    # Random students and documents visible to each role, read straight from
+    # the database so that sampling does not show up in the timings
+    rng = random.Random(seed)
+    conn = sqlite3.connect(database)
+    max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM students').fetchone()[0]
+    samples = {}
+    for role, (column, value) in role_scopes.items():
+        where, params = (f'WHERE {column} = ?', (value,)) if column else ('', ())
+        students = []
+        for _ in range(count):
+            row = conn.execute(f'SELECT student_id, name FROM students {where} '
+                               f'{"AND" if where else "WHERE"} id >= ? ORDER BY id LIMIT 1',
+                               params + (rng.randint(1, max(max_id, 1)),)).fetchone()
+            if row is None:
+                row = conn.execute(f'SELECT student_id, name FROM students {where} ORDER BY id LIMIT 1',
+                                   params).fetchone()
+            if row is not None:
+                students.append(row)
+        documents = []
+        for student_id, _ in students:
+            row = conn.execute('SELECT document_path FROM documents WHERE student_id = ? LIMIT 1',
+                               (student_id,)).fetchone()
+            if row is not None:
+                documents.append(row[0])
+        samples[role] = {'students': students, 'documents': documents}
+    conn.close()
+    return samples
+
+
+def build_requests(samples, count, seed):
+    # Route name -> list of (method, path, form) requests
+    rng = random.Random(seed)
+    students = samples['students']
+    documents = samples['documents']
+    routes = {
+        'dashboard': [('GET', '/dashboard', None)] * count,
+        'student_stats': [('GET', '/api/student_stats', None)] * count,
+        'students_page': [('GET', '/api/students', None)] * count,
+    }
+    if students:
+        routes['search_student'] = [('POST', '/search', {'student_id': rng.choice(students)[0]})
+                                    for _ in range(count)]
+        routes['api_search'] = [('GET', '/api/search?' + urlencode({'q': rng.choice(students)[1].split()[0][:5]}), None)
+                                for _ in range(count)]
+    if documents:
+        routes['download'] = [('GET', '/download/' + quote(rng.choice(documents)), None) for _ in range(count)]
+    return routes
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)]
+
+
+def summarize(timings, errors, elapsed):
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3) if timings else 0.0,
+        'max_ms': round(timings[-1] * 1000, 3) if timings else 0.0,
+        'throughput_rps': round(len(timings) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def run_client(app, logins, requests_by_role):
+    results = {}
+    for role, routes in requests_by_role.items():
+        client = app.test_client()
+        username, password = logins[role]
+        client.post('/login', data={'username': username, 'password': password})
+        for route, requests in routes.items():
+            timings = []
+            errors = 0
+            started = time.perf_counter()
+            for method, path, form in requests:
+                request_started = time.perf_counter()
+                response = client.open(path, method=method, data=form)
+                response.get_data()
+                response.close()
+                timings.append(time.perf_counter() - request_started)
+                errors += response.status_code >= 400
+            results[f'{role}/{route}'] = summarize(timings, errors, time.perf_counter() - started)
+            print(f"{role + '/' + route:<28} {results[f'{role}/{route}']}")
+    return results
+
+
+def serve(sock, workdir):
+    # One worker process: a threaded werkzeug server accepting on the
+    # listening socket it shares with the other workers
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    os.chdir(workdir)
+    from app import create_app
+    app = create_app()
+    host, port = sock.getsockname()[:2]
+    make_server(host, port, app, threaded=True, request_handler=QuietHandler,
+                fd=sock.fileno()).serve_forever()
+
+
+def start_server(workdir, workers):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(1024)
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=serve, args=(sock, workdir), daemon=True) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    port = sock.getsockname()[1]
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/login')
+            connection.getresponse().read()
+            connection.close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+    return port, processes
+
+
+def http_login(port, username, password):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.request('POST', '/login', body=urlencode({'username': username, 'password': password}),
+                       headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    cookie = SimpleCookie()
+    for header in response.headers.get_all('Set-Cookie') or []:
+        cookie.load(header)
+    return '; '.join(f'{name}={morsel.value}' for name, morsel in cookie.items())
+
+
+def run_server(port, logins, requests_by_role, concurrency):
+    results = {}
+    for role, routes in requests_by_role.items():
+        cookie = http_login(port, *logins[role])
+        for route, requests in routes.items():
+            pending = list(requests)
+            timings = []
+            errors = [0]
+            lock = threading.Lock()
+
+            def worker():
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                while True:
+                    with lock:
+                        if not pending:
+                            break
+                        method, path, form = pending.pop()
+                    body = urlencode(form) if form else None
+                    headers = {'Cookie': cookie}
+                    if body:
+                        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+                    request_started = time.perf_counter()
+                    try:
+                        connection.request(method, path, body=body, headers=headers)
+                        response = connection.getresponse()
+                        response.read()
+                        failed = response.status >= 400
+                    except (OSError, http.client.HTTPException):
+                        connection.close()
+                        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                        failed = True
+                    elapsed = time.perf_counter() - request_started
+                    with lock:
+                        timings.append(elapsed)
+                        errors[0] += failed
+                connection.close()
+
+            threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[f'{role}/{route}'] = summarize(timings, errors[0], time.perf_counter() - started)
+            print(f"{role + '/' + route:<28} {results[f'{role}/{route}']}")
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    print(f'\nchange against {baseline_path}:')
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        changes = []
+        for metric in ('p50_ms', 'p99_ms', 'throughput_rps'):
+            if previous[metric]:
+                changes.append(f'{metric} {(current[metric] - previous[metric]) / previous[metric] * 100:+.1f}%')
+        print(f"{key:<28} {' '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', required=True, help='Directory created by generate_campus.py')
+    parser.add_argument('--mode', choices=['client', 'server'], default='client')
+    parser.add_argument('--workers', type=int, default=4, help='Server processes (server mode)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads (server mode)')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per role and route')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help='Save the results as JSON')
+    parser.add_argument('--compare', help='Earlier --output file to compare against')
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    workdir = os.path.abspath(args.dir)
+    manifest_path = os.path.join(workdir, 'campus.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    logins = manifest.get('logins', DEFAULT_LOGINS)
+
+    # database.db and the other files in the default config are relative to
+    # the working directory. The schema is brought up to date before any
+    # request is timed.
+    os.chdir(workdir)
+    from app import create_app, migrate_db
+    app = create_app()
+    migrate_db()
+    app.config['UPLOAD_FOLDER'] = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    conn = sqlite3.connect(app.config['DATABASE'])
+    scopes = {'super_admin': (None, None)}
+    for role in ('school', 'department'):
+        scopes[role] = (role, conn.execute(f'SELECT {role} FROM users WHERE username = ?',
+                                           (logins[role][0],)).fetchone()[0])
+    conn.close()
+    samples = load_samples(app.config['DATABASE'], scopes, min(args.requests, 1000), args.seed)
+    requests_by_role = {role: build_requests(samples[role], args.requests, args.seed) for role in scopes}
+
+    if args.mode == 'client':
+        results = run_client(app, logins, requests_by_role)
+    else:
+        port, processes = start_server(workdir, args.workers)
+        try:
+            results = run_server(port, logins, requests_by_role, args.concurrency)
+        finally:
+            for process in processes:
+                process.terminate()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'revision': git_revision(),
+            'python': sys.version.split()[0],
+            'mode': args.mode,
+            'workers': args.workers if args.mode == 'server' else 1,
+            'concurrency': args.concurrency if args.mode == 'server' else 1,
+            'requests_per_route': args.requests,
+            'dataset': manifest,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(os.path.join(cwd, args.output), 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, os.path.join(cwd, args.compare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Logins per second per core under different password-hash policies.
+
+    python benchmarks/login_bench.py --policy pbkdf2:sha256:260000 --policy pbkdf2:sha256:600000
+
+For each policy this reports the raw hash-verification rate and the rate of
+full POST /login requests through the Flask test client (user-record cache,
+session cookie and redirect included). Everything runs on one thread, so the
+numbers are per core; multiply by worker processes to size a login spike.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_POLICIES = ['pbkdf2:sha256:100000', 'pbkdf2:sha256:260000', 'pbkdf2:sha256:600000']
+
+
+def rate(func, seconds):
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        func()
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--policy', action='append', help='Werkzeug hash method; repeatable')
+    parser.add_argument('--seconds', type=float, default=3.0, help='Measuring time per policy and mode')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='login-bench-')
+    # database.db and the other files in the default config are relative to
+    # the working directory
+    os.chdir(workdir)
+    from app import create_app, get_db_connection, get_user_cache, init_db
+    app = create_app()
+    init_db()
+    from passwords import PasswordPolicy
+
+    client = app.test_client()
+    print(f"{'policy':<24} {'verify/s':>10} {'login/s':>10} {'ms/login':>10}")
+    for method in args.policy or DEFAULT_POLICIES:
+        policy = PasswordPolicy(method)
+        password_hash = policy.hash('admin123')
+        verify_rate = rate(lambda: policy.verify(password_hash, 'admin123'), args.seconds)
+
+        # Store the hash under this policy so login does not rehash it
+        app.config['PASSWORD_HASH_METHOD'] = method
+        app.extensions.pop('password_policy', None)
+        with app.app_context():
+            conn = get_db_connection()
+            conn.execute("UPDATE users SET password = ? WHERE username = 'cse_admin'", (password_hash,))
+            conn.commit()
+        get_user_cache().clear()
+
+        def login():
+            response = client.post('/login', data={'username': 'cse_admin', 'password': 'admin123'})
+            assert response.status_code == 302, response.status_code
+        login_rate = rate(login, args.seconds)
+        print(f'{policy.method:<24} {verify_rate:>10.1f} {login_rate:>10.1f} {1000 / login_rate:>10.2f}')
+
+    os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Latency of /api/search against a synthetic student table.
+
+    python benchmarks/search_bench.py --students 1000000
+
+Builds a throwaway database in a temporary directory, fills it through the
+normal triggers, then times prefix searches through the Flask test client.
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Names are built from syllables so that, like a real roster, most names are
+# shared by a handful of students rather than by 5% of the table.
+SYLLABLES = ['an', 'ar', 'vi', 'ka', 'ra', 'ma', 'ni', 'sh', 'pr', 'ja', 'de', 'li', 'su', 'ro', 'ta',
+             'mi', 'na', 'ha', 'ke', 'lo', 'be', 'ch', 'di', 'ga', 'ya', 'th', 'el', 'os', 'ur', 'in']
+DEPARTMENTS = [('Engineering', 'CSE'), ('Engineering', 'EEE'), ('Engineering', 'Mech'),
+               ('Arts', 'B.Sc (CS)'), ('Arts', 'BCA'), ('Arts', 'B.Com'), ('Arts', 'Economics')]
+
+
+def make_name(rng):
+    return ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))).capitalize()
+
+
+def fill(conn, count, batch=20000):
+    rng = random.Random(42)
+    for start in range(0, count, batch):
+        rows = []
+        for i in range(start, min(start + batch, count)):
+            first, last = make_name(rng), make_name(rng)
+            school, department = rng.choice(DEPARTMENTS)
+            rows.append((f'S{i:07d}', f'{first} {last}', f'{first.lower()}.{last.lower()}{i}@example.com',
+                         f'{rng.randrange(10**9, 10**10)}', department, school))
+        with conn:
+            conn.executemany('INSERT INTO students (student_id, name, email, phone, department, school) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='search-bench-')
+    # database.db and the other files in the default config are relative to
+    # the working directory
+    os.chdir(workdir)
+    from app import create_app, get_db_connection, init_db
+    app = create_app()
+    init_db()
+
+    with app.app_context():
+        conn = get_db_connection()
+        started = time.perf_counter()
+        fill(conn, args.students)
+        print(f'inserted {args.students} students in {time.perf_counter() - started:.1f}s')
+
+    rng = random.Random(7)
+    names = [make_name(rng) for _ in range(args.queries)]
+    terms = ([name[:rng.randint(4, len(name))] for name in names[:args.queries // 2]] +
+             [f'{name} {make_name(rng)[:3]}' for name in names[args.queries // 2:args.queries * 3 // 4]] +
+             [f'S{rng.randrange(args.students):07d}' for _ in range(args.queries - args.queries * 3 // 4)])
+
+    client = app.test_client()
+    for username, password in [('superadmin', 'superadmin123'), ('cse_admin', 'admin123')]:
+        client.post('/login', data={'username': username, 'password': password})
+        timings = []
+        for term in terms:
+            started = time.perf_counter()
+            response = client.get('/api/search', query_string={'q': term})
+            timings.append((time.perf_counter() - started) * 1000)
+            assert response.status_code == 200, response.status_code
+        timings.sort()
+        print(f'{username:>10}: n={len(timings)} p50={statistics.median(timings):.2f}ms '
+              f'p99={timings[int(len(timings) * 0.99) - 1]:.2f}ms max={timings[-1]:.2f}ms')
+
+    os.chdir(ROOT)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Cold start time of a worker, each sample in a fresh interpreter.
+
+    python benchmarks/startup.py --runs 20
+    python benchmarks/startup.py --dir /tmp/campus --output startup.json --compare before.json
+
+Times, against the bare interpreter and a bare `import flask`: importing
+app.py, calling create_app(), and serving the first request (GET /login,
+which includes the one-time schema check). --dir points at an existing
+database such as one made by generate_campus.py; by default a temporary
+one is migrated and seeded first, outside the timings.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = {
+    'interpreter': 'pass',
+    'import flask': 'import flask',
+    'import app': 'import app',
+    'create_app': 'from app import create_app; create_app()',
+    'first request': ("from app import create_app; app = create_app(); "
+                      "assert app.test_client().get('/login').status_code == 200"),
+}
+
+
+def run(code, workdir):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    # Deployed workers load cached bytecode, so the warm-up run may write it
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=workdir, env=env, check=True)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', help='Working directory with database.db [default: a fresh temporary one]')
+    parser.add_argument('--runs', type=int, default=20, help='Samples per stage')
+    parser.add_argument('--output', help='Save the results as JSON')
+    parser.add_argument('--compare', help='Earlier --output file to compare against')
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.dir) if args.dir else tempfile.mkdtemp(prefix='startup-bench-')
+    # Untimed: schema and seed data, and warm .pyc files and page cache
+    run('from app import create_app, init_db; create_app(); init_db()', workdir)
+    for code in STAGES.values():
+        run(code, workdir)
+
+    results = {}
+    for stage, code in STAGES.items():
+        timings = sorted(run(code, workdir) for _ in range(args.runs))
+        results[stage] = {
+            'median_ms': round(statistics.median(timings) * 1000, 1),
+            'min_ms': round(timings[0] * 1000, 1),
+            'max_ms': round(timings[-1] * 1000, 1),
+        }
+    baseline = results['interpreter']['median_ms']
+    for stage, result in results.items():
+        result['over_interpreter_ms'] = round(result['median_ms'] - baseline, 1)
+        print(f"{stage:<14} median {result['median_ms']:>7.1f} ms  min {result['min_ms']:>7.1f} ms  "
+              f"+{result['over_interpreter_ms']:.1f} ms over the interpreter")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                                'python': sys.version.split()[0], 'runs': args.runs, 'dir': args.dir},
+                       'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline_results = json.load(f)['results']
+        print(f'\nchange against {args.compare}:')
+        for stage, result in results.items():
+            previous = baseline_results.get(stage)
+            if previous and previous['median_ms']:
+                change = (result['median_ms'] - previous['median_ms']) / previous['median_ms'] * 100
+                print(f'{stage:<14} {change:+.1f}%')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class CacheBackend:
+    # Minimal interface a cache backend has to provide. Values must be
+    # JSON-serialisable so that shared backends can store them.
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete_many(self, keys):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    # Per-process LRU with a TTL per entry
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._data), 'maxsize': self.maxsize, 'evictions': self.evictions}
+
+
+class SQLiteBackend(CacheBackend):
+    # Shared backend for several worker processes on one host. Stands in for
+    # a network cache; anything with the same four methods can replace it.
+    def __init__(self, path, maxsize=256):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = OFF')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+        ''')
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return MISSING
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                               (key, json.dumps(value), time.time() + ttl))
+            # Expired rows go first, then the ones closest to expiry
+            self._conn.execute('''
+                DELETE FROM cache WHERE expires < ? OR key IN (
+                    SELECT key FROM cache ORDER BY expires DESC LIMIT -1 OFFSET ?
+                )
+            ''', (time.time(), self.maxsize))
+
+    def delete_many(self, keys):
+        with self._lock:
+            self._conn.executemany('DELETE FROM cache WHERE key = ?', [(key,) for key in keys])
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM cache')
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        return {'entries': entries, 'maxsize': self.maxsize}
+
+
+def scope_key(role, school, department):
+    # Cache scope for a session. Department admins only ever see counts for
+    # their department name, so their scope ignores the school.
+    if role == 'super_admin':
+        return 'super_admin'
+    if role == 'school':
+        return f'school:{school}'
+    return f'department:{department}'
+
+
+class ScopedCache:
+    # Role-scoped response cache with hit/miss counters. Entries are keyed as
+    # "<name>:<scope>", e.g. "stats:school:Engineering".
+    def __init__(self, backend, ttl=30):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key, compute):
+        value = self.backend.get(key)
+        if value is not MISSING:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        value = compute()
+        self.backend.set(key, value, self.ttl)
+        return value
+
+    def invalidate(self, names, school, department):
+        # Drops the entries of every scope that can see (school, department)
+        scopes = ['super_admin', f'school:{school}', f'department:{department}']
+        self.backend.delete_many([f'{name}:{scope}' for name in names for scope in scopes])
+
+    def delete(self, *keys):
+        self.backend.delete_many(keys)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'ttl': self.ttl,
+            }
+        stats.update(self.backend.stats())
+        return stats
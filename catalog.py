@@ -0,0 +1,74 @@
+import threading
+import time
+
+
+class Catalog:
+    # In-memory copy of the schools/departments reference tables. It is loaded
+    # on first use and reloaded when catalog_version changes, which triggers
+    # bump on every insert or delete, so other workers pick up edits within
+    # check_interval seconds.
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = 0.0
+        self._schools = ()
+        self._departments = {}
+
+    def _load(self, conn):
+        version = conn.execute('SELECT version FROM catalog_version WHERE id = 1').fetchone()[0]
+        schools = tuple(row[0] for row in conn.execute('SELECT name FROM schools ORDER BY name'))
+        departments = {school: () for school in schools}
+        for school, name in conn.execute('SELECT school, name FROM departments ORDER BY school, name'):
+            departments[school] = departments.get(school, ()) + (name,)
+        self._schools = schools
+        self._departments = departments
+        self._version = version
+        self._checked = time.monotonic()
+
+    def refresh(self, conn, force=False):
+        with self._lock:
+            if not force and self._version is not None and \
+                    time.monotonic() - self._checked < self.check_interval:
+                return
+            version = conn.execute('SELECT version FROM catalog_version WHERE id = 1').fetchone()[0]
+            if force or version != self._version:
+                self._load(conn)
+            else:
+                self._checked = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+    def schools(self, conn):
+        self.refresh(conn)
+        return self._schools
+
+    def departments(self, conn, school=None):
+        self.refresh(conn)
+        if school is not None:
+            return self._departments.get(school, ())
+        names = set()
+        for school_departments in self._departments.values():
+            names.update(school_departments)
+        return tuple(sorted(names))
+
+    def has_department(self, conn, school, department):
+        self.refresh(conn)
+        return department in self._departments.get(school, ())
+
+    def pairs(self, conn):
+        self.refresh(conn)
+        return {(school, name) for school, names in self._departments.items() for name in names}
+
+    def as_dict(self, conn):
+        self.refresh(conn)
+        return {school: list(names) for school, names in self._departments.items()}
+
+
+def add_departments(conn, pairs):
+    # Inserts any missing (school, department) pairs; does not commit
+    pairs = list(pairs)
+    conn.executemany('INSERT OR IGNORE INTO schools (name) VALUES (?)', [(school,) for school, _ in pairs])
+    conn.executemany('INSERT OR IGNORE INTO departments (school, name) VALUES (?, ?)', pairs)
@@ -0,0 +1,624 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# PRAGMAs applied to every pooled connection. journal_mode=WAL is persistent in
+# the database file, the rest are per-connection settings.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,       # negative = KiB, so ~16MB page cache
+    'mmap_size': 64 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+
+# Connections that only serve reads: the primary's read pool and replicas
+READ_PRAGMAS = dict(DEFAULT_PRAGMAS, query_only='ON')
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection(sqlite3.Connection):
+    # Routes still call conn.close() when they are done; for a pooled
+    # connection that is a no-op and the connection goes back to the pool
+    # when the app context is torn down.
+    def close(self):
+        pass
+
+    def dispose(self):
+        super().close()
+
+
+class ConnectionPool:
+    def __init__(self, database, size=5, timeout=10.0, busy_timeout=5000, pragmas=None):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout / 1000.0,
+                               check_same_thread=False, factory=PooledConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def acquire(self):
+        start = time.perf_counter()
+        waited = False
+        conn = None
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                waited = True
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(f'no database connection available after {self.timeout}s')
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += elapsed
+                self._max_wait = max(self._max_wait, elapsed)
+        return conn
+
+    def release(self, conn):
+        # Anything a request left uncommitted (an error halfway through a
+        # write, for instance) must not leak into the next checkout.
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.dispose()
+            with self._lock:
+                self._created -= 1
+                self._in_use -= 1
+            return
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.dispose()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._created,
+                'in_use': self._in_use,
+                'idle': self._created - self._in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'wait_time_total': round(self._wait_time, 6),
+                'wait_time_max': round(self._max_wait, 6),
+            }
+
+
+class Replica:
+    # Read-only copy of the primary database in its own file, refreshed with
+    # SQLite's online backup API. Both files are in WAL mode, so neither the
+    # primary's writers nor the replica's readers wait for a refresh: readers
+    # keep their snapshot until the copy commits.
+    #
+    # A refresh is skipped when nothing was committed to the primary since
+    # the last one. The time of the last refresh is kept as the mtime of
+    # <path>.synced so that every worker process sees the same lag, and a
+    # lock file keeps two processes from copying at the same time.
+    def __init__(self, primary, path, interval=5.0, pool_size=5, busy_timeout=5000):
+        self.primary = primary
+        self.path = path
+        self.interval = interval
+        self.pool = ConnectionPool(path, size=pool_size, busy_timeout=busy_timeout, pragmas=READ_PRAGMAS)
+        self._lock = threading.Lock()
+        self._source = None
+        self._data_version = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self.refreshes = 0
+        self.skipped = 0
+        self.last_duration = 0.0
+
+    def refresh(self, force=False):
+        # Returns True if the primary was copied
+        with self._lock:
+            if self._source is None:
+                self._source = sqlite3.connect(self.primary, check_same_thread=False)
+            started = time.time()
+            version = self._source.execute('PRAGMA data_version').fetchone()[0]
+            if not force and version == self._data_version and os.path.exists(self.path):
+                self._mark_synced(started)
+                self.skipped += 1
+                return False
+            with open(self.path + '.lock', 'w') as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        # Another process is refreshing the replica
+                        return False
+                target = sqlite3.connect(self.path, timeout=self.pool.busy_timeout / 1000.0)
+                try:
+                    target.execute('PRAGMA journal_mode = WAL')
+                    self._source.backup(target)
+                finally:
+                    target.close()
+            self._data_version = version
+            self._mark_synced(started)
+            self.refreshes += 1
+            self.last_duration = time.time() - started
+            return True
+
+    def _mark_synced(self, when):
+        marker = self.path + '.synced'
+        with open(marker, 'a'):
+            pass
+        os.utime(marker, (when, when))
+
+    def lag(self):
+        # Seconds since the replica last matched the primary, None if it has
+        # never been refreshed
+        try:
+            return max(time.time() - os.stat(self.path + '.synced').st_mtime, 0.0)
+        except OSError:
+            return None
+
+    def start(self):
+        # Background refresh every interval seconds; with interval 0 another
+        # process (e.g. `flask refresh-replicas`) has to keep it current
+        with self._lock:
+            if self._thread is not None or not self.interval:
+                return
+
+            self._stopped.clear()
+
+            def run():
+                while not self._stopped.is_set():
+                    try:
+                        self.refresh()
+                    except sqlite3.Error:
+                        pass
+                    self._stopped.wait(self.interval)
+
+            self._thread = threading.Thread(target=run, name=f'replica-{os.path.basename(self.path)}', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        # Stops the refresh thread and closes the replica's connections
+        self._stopped.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            if self._source is not None:
+                self._source.close()
+                self._source = None
+        self.pool.close_all()
+
+    def stats(self):
+        lag = self.lag()
+        return {
+            'path': self.path,
+            'lag': None if lag is None else round(lag, 3),
+            'refreshes': self.refreshes,
+            'skipped': self.skipped,
+            'last_refresh_duration': round(self.last_duration, 6),
+            'pool': self.pool.stats(),
+        }
+
+
+# Schema migrations, applied in order by migrate(). The schema version is kept
+# in PRAGMA user_version; never edit a migration once it has shipped, add a
+# new one instead.
+MIGRATIONS = [
+    (1, '''
+        CREATE INDEX IF NOT EXISTS idx_students_school_department ON students (school, department);
+        CREATE INDEX IF NOT EXISTS idx_students_department ON students (department);
+        CREATE INDEX IF NOT EXISTS idx_students_created_at ON students (created_at);
+        CREATE INDEX IF NOT EXISTS idx_documents_student_id ON documents (student_id);
+    '''),
+    # Per (school, department) student counters for the dashboard and
+    # /api/student_stats, kept exact by triggers on students.
+    (2, '''
+        CREATE TABLE IF NOT EXISTS student_counts (
+            school TEXT NOT NULL,
+            department TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (school, department)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_student_counts_department ON student_counts (department);
+
+        INSERT OR REPLACE INTO student_counts (school, department, count)
+            SELECT school, department, COUNT(*) FROM students GROUP BY school, department;
+
+        CREATE TRIGGER IF NOT EXISTS student_counts_insert AFTER INSERT ON students
+        BEGIN
+            INSERT INTO student_counts (school, department, count) VALUES (NEW.school, NEW.department, 1)
+                ON CONFLICT (school, department) DO UPDATE SET count = count + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS student_counts_delete AFTER DELETE ON students
+        BEGIN
+            UPDATE student_counts SET count = count - 1
+                WHERE school = OLD.school AND department = OLD.department;
+            DELETE FROM student_counts
+                WHERE school = OLD.school AND department = OLD.department AND count <= 0;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS student_counts_update AFTER UPDATE OF school, department ON students
+        WHEN OLD.school IS NOT NEW.school OR OLD.department IS NOT NEW.department
+        BEGIN
+            UPDATE student_counts SET count = count - 1
+                WHERE school = OLD.school AND department = OLD.department;
+            DELETE FROM student_counts
+                WHERE school = OLD.school AND department = OLD.department AND count <= 0;
+            INSERT INTO student_counts (school, department, count) VALUES (NEW.school, NEW.department, 1)
+                ON CONFLICT (school, department) DO UPDATE SET count = count + 1;
+        END;
+    '''),
+    # Keyset pagination of /api/students walks (created_at, id) within a
+    # scope, so every scope index carries created_at as its last column.
+    (3, '''
+        DROP INDEX IF EXISTS idx_students_department;
+        DROP INDEX IF EXISTS idx_students_school_department;
+        CREATE INDEX IF NOT EXISTS idx_students_department_created ON students (department, created_at);
+        CREATE INDEX IF NOT EXISTS idx_students_school_created ON students (school, created_at);
+        CREATE INDEX IF NOT EXISTS idx_students_school_department_created ON students (school, department, created_at);
+    '''),
+    # Full-text index for /api/search. One row per student, rowid = students.id,
+    # with the student's document names concatenated into one column.
+    (4, '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS student_search USING fts5 (
+            student_id, name, email, phone, documents,
+            tokenize = 'unicode61', prefix = '2 3'
+        );
+
+        INSERT INTO student_search (rowid, student_id, name, email, phone, documents)
+            SELECT s.id, s.student_id, s.name, COALESCE(s.email, ''), COALESCE(s.phone, ''),
+                   COALESCE((SELECT group_concat(d.document_name, ' ') FROM documents d
+                             WHERE d.student_id = s.student_id), '')
+            FROM students s;
+
+        CREATE TRIGGER IF NOT EXISTS student_search_insert AFTER INSERT ON students
+        BEGIN
+            INSERT INTO student_search (rowid, student_id, name, email, phone, documents)
+            VALUES (NEW.id, NEW.student_id, NEW.name, COALESCE(NEW.email, ''), COALESCE(NEW.phone, ''),
+                    COALESCE((SELECT group_concat(document_name, ' ') FROM documents
+                              WHERE student_id = NEW.student_id), ''));
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS student_search_update AFTER UPDATE OF student_id, name, email, phone ON students
+        BEGIN
+            UPDATE student_search
+                SET student_id = NEW.student_id, name = NEW.name,
+                    email = COALESCE(NEW.email, ''), phone = COALESCE(NEW.phone, '')
+                WHERE rowid = NEW.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS student_search_delete AFTER DELETE ON students
+        BEGIN
+            DELETE FROM student_search WHERE rowid = OLD.id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS student_search_document_insert AFTER INSERT ON documents
+        BEGIN
+            UPDATE student_search
+                SET documents = COALESCE((SELECT group_concat(document_name, ' ') FROM documents
+                                          WHERE student_id = NEW.student_id), '')
+                WHERE rowid = (SELECT id FROM students WHERE student_id = NEW.student_id);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS student_search_document_delete AFTER DELETE ON documents
+        BEGIN
+            UPDATE student_search
+                SET documents = COALESCE((SELECT group_concat(document_name, ' ') FROM documents
+                                          WHERE student_id = OLD.student_id), '')
+                WHERE rowid = (SELECT id FROM students WHERE student_id = OLD.student_id);
+        END;
+    '''),
+    # File authorization resolves a stored file name to its owning students
+    (5, '''
+        CREATE INDEX IF NOT EXISTS idx_documents_document_path ON documents (document_path);
+        CREATE INDEX IF NOT EXISTS idx_students_photo_path ON students (photo_path);
+    '''),
+    # Reference counts for content-addressed uploads (see storage.BlobStore)
+    (6, '''
+        CREATE TABLE IF NOT EXISTS blobs (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    '''),
+    # Background job queue (see jobs.py)
+    (7, '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            run_after REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON jobs (status, run_after);
+    '''),
+    # Resumable chunked uploads in progress; the bytes live in
+    # UPLOAD_FOLDER/.partial/<id> until the last chunk arrives
+    (8, '''
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            student_id TEXT NOT NULL,
+            document_name TEXT NOT NULL,
+            ext TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            received INTEGER NOT NULL DEFAULT 0,
+            username TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    '''),
+    # School/department reference tables behind catalog.Catalog, seeded from
+    # the existing students and admin accounts
+    (9, '''
+        CREATE TABLE IF NOT EXISTS schools (
+            name TEXT PRIMARY KEY
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS departments (
+            school TEXT NOT NULL REFERENCES schools (name),
+            name TEXT NOT NULL,
+            PRIMARY KEY (school, name)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0);
+
+        INSERT OR IGNORE INTO schools (name)
+            SELECT school FROM student_counts
+            UNION SELECT school FROM users WHERE school IS NOT NULL;
+        INSERT OR IGNORE INTO departments (school, name)
+            SELECT school, department FROM student_counts
+            UNION SELECT school, department FROM users WHERE school IS NOT NULL AND department IS NOT NULL;
+
+        CREATE TRIGGER IF NOT EXISTS catalog_school_insert AFTER INSERT ON schools
+        BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END;
+        CREATE TRIGGER IF NOT EXISTS catalog_school_delete AFTER DELETE ON schools
+        BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END;
+        CREATE TRIGGER IF NOT EXISTS catalog_department_insert AFTER INSERT ON departments
+        BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END;
+        CREATE TRIGGER IF NOT EXISTS catalog_department_delete AFTER DELETE ON departments
+        BEGIN UPDATE catalog_version SET version = version + 1 WHERE id = 1; END;
+    '''),
+    # Last run of each maintenance task (see maintenance.py); scheduled_at
+    # doubles as the claim that keeps two schedulers from queueing a task twice
+    (10, '''
+        CREATE TABLE IF NOT EXISTS maintenance_runs (
+            task TEXT PRIMARY KEY,
+            scheduled_at REAL NOT NULL DEFAULT 0,
+            finished_at REAL,
+            duration REAL,
+            result TEXT
+        );
+    '''),
+    # Append-only change feed behind /api/changes, written by triggers in the
+    # transaction of the change itself. seq never goes backwards or gets
+    # reused (AUTOINCREMENT), so it is the consumers' cursor. school and
+    # department scope each change, old_school and old_department hold the
+    # scope a student left when an update moved it.
+    (11, '''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            op TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            student_id TEXT NOT NULL,
+            school TEXT,
+            department TEXT,
+            old_school TEXT,
+            old_department TEXT,
+            data TEXT,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TRIGGER IF NOT EXISTS changes_student_insert AFTER INSERT ON students
+        BEGIN
+            INSERT INTO changes (entity, op, row_id, student_id, school, department, data)
+            VALUES ('student', 'insert', NEW.id, NEW.student_id, NEW.school, NEW.department,
+                    json_object('id', NEW.id, 'student_id', NEW.student_id, 'name', NEW.name, 'email', NEW.email,
+                                'phone', NEW.phone, 'department', NEW.department, 'school', NEW.school,
+                                'photo_path', NEW.photo_path, 'created_at', NEW.created_at));
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS changes_student_update AFTER UPDATE ON students
+        WHEN OLD.student_id IS NOT NEW.student_id OR OLD.name IS NOT NEW.name OR OLD.email IS NOT NEW.email
+            OR OLD.phone IS NOT NEW.phone OR OLD.department IS NOT NEW.department OR OLD.school IS NOT NEW.school
+            OR OLD.photo_path IS NOT NEW.photo_path
+        BEGIN
+            INSERT INTO changes (entity, op, row_id, student_id, school, department, old_school, old_department, data)
+            VALUES ('student', 'update', NEW.id, NEW.student_id, NEW.school, NEW.department,
+                    NULLIF(OLD.school, NEW.school), NULLIF(OLD.department, NEW.department),
+                    json_object('id', NEW.id, 'student_id', NEW.student_id, 'name', NEW.name, 'email', NEW.email,
+                                'phone', NEW.phone, 'department', NEW.department, 'school', NEW.school,
+                                'photo_path', NEW.photo_path, 'created_at', NEW.created_at));
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS changes_student_delete AFTER DELETE ON students
+        BEGIN
+            INSERT INTO changes (entity, op, row_id, student_id, school, department, data)
+            VALUES ('student', 'delete', OLD.id, OLD.student_id, OLD.school, OLD.department,
+                    json_object('id', OLD.id, 'student_id', OLD.student_id, 'name', OLD.name, 'email', OLD.email,
+                                'phone', OLD.phone, 'department', OLD.department, 'school', OLD.school,
+                                'photo_path', OLD.photo_path, 'created_at', OLD.created_at));
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS changes_document_insert AFTER INSERT ON documents
+        BEGIN
+            INSERT INTO changes (entity, op, row_id, student_id, school, department, data)
+            SELECT 'document', 'insert', NEW.id, NEW.student_id, s.school, s.department,
+                   json_object('id', NEW.id, 'student_id', NEW.student_id, 'document_name', NEW.document_name,
+                                'document_path', NEW.document_path, 'upload_date', NEW.upload_date)
+            FROM (SELECT 1) LEFT JOIN students s ON s.student_id = NEW.student_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS changes_document_update AFTER UPDATE ON documents
+        WHEN OLD.student_id IS NOT NEW.student_id OR OLD.document_name IS NOT NEW.document_name
+            OR OLD.document_path IS NOT NEW.document_path
+        BEGIN
+            INSERT INTO changes (entity, op, row_id, student_id, school, department, data)
+            SELECT 'document', 'update', NEW.id, NEW.student_id, s.school, s.department,
+                   json_object('id', NEW.id, 'student_id', NEW.student_id, 'document_name', NEW.document_name,
+                                'document_path', NEW.document_path, 'upload_date', NEW.upload_date)
+            FROM (SELECT 1) LEFT JOIN students s ON s.student_id = NEW.student_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS changes_document_delete AFTER DELETE ON documents
+        BEGIN
+            INSERT INTO changes (entity, op, row_id, student_id, school, department, data)
+            SELECT 'document', 'delete', OLD.id, OLD.student_id, s.school, s.department,
+                   json_object('id', OLD.id, 'student_id', OLD.student_id, 'document_name', OLD.document_name,
+                                'document_path', OLD.document_path, 'upload_date', OLD.upload_date)
+            FROM (SELECT 1) LEFT JOIN students s ON s.student_id = OLD.student_id;
+        END;
+    '''),
+    # Most students have no photo. After ANALYZE a full-column index on the
+    # mostly NULL photo_path looked unselective and file authorization fell
+    # back to scanning students; the partial index only holds real paths.
+    (12, '''
+        DROP INDEX IF EXISTS idx_students_photo_path;
+        CREATE INDEX IF NOT EXISTS idx_students_photo_path ON students (photo_path) WHERE photo_path IS NOT NULL;
+    '''),
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def pending_migrations(conn):
+    current = schema_version(conn)
+    return [version for version, _ in MIGRATIONS if version > current]
+
+
+def split_statements(script):
+    # complete_statement() knows about string literals and trigger bodies,
+    # so only the semicolons that end a statement split the script
+    statements = []
+    current = ''
+    for part in script.split(';'):
+        current += part + ';'
+        if sqlite3.complete_statement(current):
+            if current.strip(' \t\n;'):
+                statements.append(current.strip())
+            current = ''
+    return statements
+
+
+def migrate(conn):
+    # Each migration runs in a write transaction that checks the version
+    # again once it holds the lock, so processes migrating side by side
+    # never apply one twice. executescript() would commit that transaction,
+    # hence one statement at a time.
+    applied = []
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for version, script in MIGRATIONS:
+            if version <= schema_version(conn):
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if version > schema_version(conn):
+                    for statement in split_statements(script):
+                        conn.execute(statement)
+                    conn.execute(f'PRAGMA user_version = {int(version)}')
+                    applied.append(version)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+def rebuild_student_counts(conn):
+    # Recomputes student_counts from the students table and returns the
+    # (school, department, stored, actual) rows that had drifted.
+    stored = {(row[0], row[1]): row[2] for row in
+              conn.execute('SELECT school, department, count FROM student_counts')}
+    actual = {(row[0], row[1]): row[2] for row in
+              conn.execute('SELECT school, department, COUNT(*) FROM students GROUP BY school, department')}
+    drift = [(school, department, stored.get((school, department), 0), actual.get((school, department), 0))
+             for school, department in sorted(set(stored) | set(actual))
+             if stored.get((school, department), 0) != actual.get((school, department), 0)]
+    with conn:
+        conn.execute('DELETE FROM student_counts')
+        conn.executemany('INSERT INTO student_counts (school, department, count) VALUES (?, ?, ?)',
+                         [(school, department, count) for (school, department), count in actual.items()])
+    return drift
+
+
+def find_table_scans(conn, sql, params=()):
+    # Returns the EXPLAIN QUERY PLAN lines that walk a whole table or index
+    # instead of seeking into it, e.g. "SCAN students" or
+    # "SCAN students USING COVERING INDEX idx_students_school_department".
+    # A virtual table reports its own plan: the FTS5 index reads only the
+    # matching rows when its index string names a constraint ("INDEX 32:M5"
+    # for MATCH) and everything when it is empty ("INDEX 0:").
+    plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    return [row[3] for row in plan if row[3].startswith('SCAN ')
+            and not (' VIRTUAL TABLE INDEX ' in row[3] and not row[3].endswith(':'))]
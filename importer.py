@@ -0,0 +1,157 @@
+import codecs
+import csv
+import json
+import sqlite3
+
+STUDENT_FIELDS = ('student_id', 'name', 'email', 'phone', 'department', 'school')
+REQUIRED_FIELDS = ('student_id', 'name', 'department', 'school')
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def detect_format(filename, default='csv'):
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def read_records(stream, fmt):
+    # Yields (line_number, record) from a binary stream without reading the
+    # whole file. A record is None when the line could not be parsed. Bytes
+    # that are not UTF-8 are kept as surrogates so the rest of the file is
+    # still read; clean_records() rejects the records that contain them.
+    lines = codecs.iterdecode(stream, 'utf-8-sig', errors='surrogateescape')
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        while True:
+            try:
+                record = next(reader)
+            except StopIteration:
+                break
+            except csv.Error:
+                record = None
+            yield reader.line_num, record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_number, record if isinstance(record, dict) else None
+    else:
+        raise ImportFormatError(f'Unsupported import format: {fmt}')
+
+
+def is_undecodable(value):
+    # surrogateescape maps each undecodable byte to U+DC80..U+DCFF
+    return any('\udc80' <= char <= '\udcff' for char in value)
+
+
+def clean_records(records, role, school=None, department=None):
+    # Normalises each record and applies the same role restrictions as
+    # insert_student(). Yields (line_number, row, error).
+    for line_number, record in records:
+        if record is None:
+            yield line_number, None, 'Malformed record'
+            continue
+        row = {field: str(record.get(field) or '').strip() for field in STUDENT_FIELDS}
+        if role == 'department':
+            row['school'], row['department'] = school, department
+        elif role == 'school':
+            row['school'] = school
+        if any(is_undecodable(value) for value in row.values()):
+            yield line_number, None, 'Not valid UTF-8'
+            continue
+        missing = [field for field in REQUIRED_FIELDS if not row[field]]
+        if missing:
+            yield line_number, None, 'Missing ' + ', '.join(missing)
+            continue
+        yield line_number, row, None
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_students(conn, rows, valid_pairs, allow_new_pairs=False, batch_size=500, max_errors=1000):
+    # Inserts cleaned rows in batched transactions. Rows that fail validation
+    # are reported and skipped, they never abort the import. Only the current
+    # batch is held in memory, and at most max_errors error entries are kept.
+    report = {'imported': 0, 'failed': 0, 'errors': [], 'errors_truncated': False}
+    touched = set()
+
+    def fail(line_number, student_id, message):
+        report['failed'] += 1
+        if len(report['errors']) < max_errors:
+            report['errors'].append({'line': line_number, 'student_id': student_id, 'error': message})
+        else:
+            report['errors_truncated'] = True
+
+    for batch in batched(rows, batch_size):
+        candidates = []
+        for line_number, row, error in batch:
+            if error:
+                fail(line_number, None, error)
+                continue
+            pair = (row['school'], row['department'])
+            if pair not in valid_pairs:
+                if not allow_new_pairs:
+                    fail(line_number, row['student_id'], 'Invalid department for this school')
+                    continue
+                valid_pairs.add(pair)
+            candidates.append((line_number, row))
+
+        ids = [row['student_id'] for _, row in candidates]
+        existing = set()
+        # Stay well below SQLITE_MAX_VARIABLE_NUMBER
+        for chunk in batched(ids, 500):
+            placeholders = ','.join('?' * len(chunk))
+            existing.update(r[0] for r in conn.execute(
+                f'SELECT student_id FROM students WHERE student_id IN ({placeholders})', chunk))
+
+        accepted = []
+        for line_number, row in candidates:
+            if row['student_id'] in existing:
+                fail(line_number, row['student_id'], 'Student ID already exists')
+                continue
+            existing.add(row['student_id'])
+            accepted.append((line_number, row))
+            touched.add((row['school'], row['department']))
+
+        if not accepted:
+            continue
+        try:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO students (student_id, name, email, phone, department, school)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', [tuple(row[field] for field in STUDENT_FIELDS) for _, row in accepted])
+            report['imported'] += len(accepted)
+        except sqlite3.IntegrityError:
+            # Raced with another writer; fall back to row-by-row for this batch
+            for line_number, row in accepted:
+                try:
+                    with conn:
+                        conn.execute('''
+                            INSERT INTO students (student_id, name, email, phone, department, school)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        ''', tuple(row[field] for field in STUDENT_FIELDS))
+                    report['imported'] += 1
+                except sqlite3.IntegrityError:
+                    fail(line_number, row['student_id'], 'Student ID already exists')
+
+    report['touched'] = sorted(touched)
+    return report
@@ -0,0 +1,116 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(conn, kind, payload, delay=0):
+    # Adds a job without committing, so it becomes visible to workers
+    # together with the write that caused it
+    conn.execute('INSERT INTO jobs (kind, payload, run_after) VALUES (?, ?, ?)',
+                 (kind, json.dumps(payload), time.time() + delay))
+
+
+def claim(conn):
+    # Atomically marks the oldest runnable job as running and returns it
+    with conn:
+        return conn.execute('''
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ?
+                ORDER BY run_after, id LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts
+        ''', (time.time(),)).fetchone()
+
+
+def finish(conn, job_id, error=None, retry_in=None):
+    with conn:
+        if error is None:
+            conn.execute("UPDATE jobs SET status = 'done', error = NULL, updated_at = CURRENT_TIMESTAMP "
+                         "WHERE id = ?", (job_id,))
+        elif retry_in is not None:
+            conn.execute("UPDATE jobs SET status = 'queued', error = ?, run_after = ?, "
+                         "updated_at = CURRENT_TIMESTAMP WHERE id = ?", (error, time.time() + retry_in, job_id))
+        else:
+            conn.execute("UPDATE jobs SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP "
+                         "WHERE id = ?", (error, job_id))
+
+
+def requeue_stale(conn, older_than=600):
+    # Jobs left 'running' by a worker that died are picked up again
+    with conn:
+        return conn.execute('''
+            UPDATE jobs SET status = 'queued'
+            WHERE status = 'running' AND updated_at < datetime('now', ?)
+        ''', (f'-{int(older_than)} seconds',)).rowcount
+
+
+def queue_stats(conn):
+    return {row[0]: row[1] for row in conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')}
+
+
+class WorkerPool:
+    # A few daemon threads draining the jobs table. Each thread has its own
+    # connection; notify() wakes them up instead of waiting for the next poll.
+    def __init__(self, database, handlers, workers=2, poll_interval=5.0, max_attempts=3, retry_delay=30):
+        self.database = database
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        conn = sqlite3.connect(self.database, timeout=30)
+        conn.execute('PRAGMA busy_timeout = 30000')
+        try:
+            while not self._stopping.is_set():
+                if not self.run_once(conn):
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+        finally:
+            conn.close()
+
+    def run_once(self, conn):
+        # Runs a single job if one is ready; returns False when the queue is empty
+        job = claim(conn)
+        if job is None:
+            return False
+        job_id, kind, payload, attempts = job
+        handler = self.handlers.get(kind)
+        try:
+            if handler is None:
+                raise LookupError(f'no handler for job kind {kind!r}')
+            handler(json.loads(payload))
+        except Exception as e:
+            logger.exception('job %s (%s) failed', job_id, kind)
+            retry_in = self.retry_delay * attempts if attempts < self.max_attempts else None
+            finish(conn, job_id, error=f'{type(e).__name__}: {e}', retry_in=retry_in)
+        else:
+            finish(conn, job_id)
+        return True
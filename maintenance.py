@@ -0,0 +1,414 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from itertools import islice
+
+from jobs import enqueue
+from storage import BlobStore
+from thumbnails import PREVIEW_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+# Maintenance tasks run as 'maintenance' jobs. Each call of a task does one
+# bounded step and returns True while there is more to do; the job handler
+# then queues the next step after a pause, so a large upload folder or table
+# is worked through in small pieces between live requests. state is a JSON
+# dict carried from step to step (cursor and counters) and ends up as the
+# task's result in maintenance_runs.
+#
+# options: root (upload folder), batch_size, grace (seconds before an
+# unreferenced file counts as orphaned), session_ttl, analysis_limit,
+# vacuum_pages, change_retention, job_retention, dry_run, fix.
+
+
+def iter_files(root, after=None, skip=()):
+    # Relative paths of the files below root in sorted order, starting after
+    # the path after. Directories wholly before it are not listed again.
+    after = after.split('/') if after else None
+
+    def walk(directory, prefix):
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError:
+            return
+        for entry in entries:
+            parts = prefix + [entry.name]
+            if not prefix and entry.name in skip:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if after is None or parts >= after[:len(parts)]:
+                    yield from walk(entry.path, parts)
+            elif after is None or parts > after:
+                yield '/'.join(parts)
+
+    yield from walk(root, [])
+
+
+def file_age(path, now):
+    try:
+        return now - os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def referenced_paths(conn, paths):
+    marks = ','.join('?' * len(paths))
+    return {row[0] for row in conn.execute(f'''
+        SELECT document_path FROM documents WHERE document_path IN ({marks})
+        UNION SELECT photo_path FROM students WHERE photo_path IN ({marks}) AND photo_path IS NOT NULL
+        UNION SELECT path FROM blobs WHERE path IN ({marks})
+    ''', list(paths) * 3)}
+
+
+def remove(path, options, state):
+    if options.get('dry_run'):
+        state['removed'] = state.get('removed', 0) + 1
+        return
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except OSError:
+        return
+    state['removed'] = state.get('removed', 0) + 1
+    state['bytes_freed'] = state.get('bytes_freed', 0) + size
+
+
+def gc_uploads(conn, options, state):
+    # Deletes upload files that no documents, students or blobs row refers
+    # to, and thumbnails whose upload is gone. The reference check and the
+    # deletes run under the write lock; see BlobStore.adopt().
+    root = options['root']
+    batch = list(islice(iter_files(root, state.get('cursor'), skip=('.tmp', '.partial')), options['batch_size']))
+    if not batch:
+        return False
+    state['cursor'] = batch[-1]
+    state['scanned'] = state.get('scanned', 0) + len(batch)
+    now = time.time()
+
+    def old(rel):
+        age = file_age(os.path.join(root, *rel.split('/')), now)
+        return age is not None and age > options['grace']
+
+    uploads = [rel for rel in batch if not rel.startswith('thumbs/') and old(rel)]
+    if uploads:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            keep = referenced_paths(conn, uploads)
+            for rel in uploads:
+                if rel not in keep:
+                    logger.info('removing orphaned upload %s', rel)
+                    remove(os.path.join(root, *rel.split('/')), options, state)
+        finally:
+            conn.commit()
+
+    for rel in batch:
+        if rel.startswith('thumbs/') and old(rel):
+            stem = os.path.join(root, *rel[len('thumbs/'):].rsplit('.', 1)[0].split('/'))
+            if not any(os.path.exists(f'{stem}.{ext}') for ext in PREVIEW_EXTENSIONS):
+                remove(os.path.join(root, *rel.split('/')), options, state)
+    return len(batch) == options['batch_size']
+
+
+def cleanup_uploads(conn, options, state):
+    # Abandoned resumable uploads and temporary files of interrupted saves
+    root = options['root']
+    now = time.time()
+    stale = conn.execute("SELECT id FROM upload_sessions WHERE updated_at < datetime('now', ?)",
+                         (f"-{int(options['session_ttl'])} seconds",)).fetchall()
+    for (upload_id,) in stale:
+        if not options.get('dry_run'):
+            with conn:
+                conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+        remove(os.path.join(root, '.partial', upload_id), options, state)
+    state['expired_sessions'] = len(stale)
+
+    active = {row[0] for row in conn.execute('SELECT id FROM upload_sessions')}
+    for directory in ('.partial', '.tmp'):
+        try:
+            entries = list(os.scandir(os.path.join(root, directory)))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_file() and entry.name not in active and (file_age(entry.path, now) or 0) > options['grace']:
+                remove(entry.path, options, state)
+    return False
+
+
+def reconcile_blobs(conn, options, state):
+    # Corrects blobs.refcount from the actual references. Rows nothing refers
+    # to any more are dropped and their files deleted.
+    rows = conn.execute('''
+        SELECT b.path, b.refcount,
+               (SELECT COUNT(*) FROM documents WHERE document_path = b.path) +
+               (SELECT COUNT(*) FROM students WHERE photo_path = b.path AND photo_path IS NOT NULL)
+        FROM blobs b WHERE b.path > ? ORDER BY b.path LIMIT ?
+    ''', (state.get('cursor', ''), options['batch_size'])).fetchall()
+    if not rows:
+        return False
+    state['cursor'] = rows[-1][0]
+    state['checked'] = state.get('checked', 0) + len(rows)
+    drift = [(path, stored, actual) for path, stored, actual in rows if stored != actual]
+    if drift and not options.get('dry_run'):
+        store = BlobStore(options['root'])
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for path, stored, actual in drift:
+                # Recounted under the write lock in case an upload got in first
+                actual = conn.execute('''
+                    SELECT (SELECT COUNT(*) FROM documents WHERE document_path = ?) +
+                           (SELECT COUNT(*) FROM students WHERE photo_path = ? AND photo_path IS NOT NULL)
+                ''', (path, path)).fetchone()[0]
+                if actual:
+                    conn.execute('UPDATE blobs SET refcount = ? WHERE path = ?', (actual, path))
+                else:
+                    conn.execute('DELETE FROM blobs WHERE path = ?', (path,))
+                    remove(store.full_path(path), options, state)
+        finally:
+            conn.commit()
+    for path, stored, actual in drift:
+        logger.warning('blob %s: refcount %s, %s reference(s)', path, stored, actual)
+    state['corrected'] = state.get('corrected', 0) + len(drift)
+    return len(rows) == options['batch_size']
+
+
+def check_references(conn, options, state):
+    # Finds documents rows and student photos whose file is missing. With
+    # the fix option the dangling documents rows are deleted and the photo
+    # references cleared; otherwise they are only reported.
+    store = BlobStore(options['root'])
+    table = state.setdefault('table', 'documents')
+    if table == 'documents':
+        rows = conn.execute('SELECT id, document_path FROM documents WHERE id > ? ORDER BY id LIMIT ?',
+                            (state.get('cursor', 0), options['batch_size'])).fetchall()
+    else:
+        rows = conn.execute('SELECT id, photo_path FROM students WHERE id > ? AND photo_path IS NOT NULL '
+                            'ORDER BY id LIMIT ?', (state.get('cursor', 0), options['batch_size'])).fetchall()
+    missing = [(row_id, path) for row_id, path in rows if not os.path.isfile(store.full_path(path))]
+    if missing:
+        key = f'missing_{table}'
+        state[key] = state.get(key, 0) + len(missing)
+        sample = state.setdefault(f'{key}_sample', [])
+        sample.extend(path for _, path in missing[:20 - len(sample)])
+        if options.get('fix') and not options.get('dry_run'):
+            with conn:
+                for row_id, path in missing:
+                    if table == 'documents':
+                        conn.execute('DELETE FROM documents WHERE id = ?', (row_id,))
+                    else:
+                        conn.execute('UPDATE students SET photo_path = NULL WHERE id = ?', (row_id,))
+                    store.release(conn, path)
+            state['fixed'] = state.get('fixed', 0) + len(missing)
+    if len(rows) == options['batch_size']:
+        state['cursor'] = rows[-1][0]
+        return True
+    if table == 'documents':
+        state['table'] = 'students'
+        state['cursor'] = 0
+        return True
+    return False
+
+
+def optimize(conn, options, state):
+    # Cheap: lets SQLite re-analyze tables whose statistics are out of date,
+    # and checkpoints the WAL without waiting for readers
+    conn.execute('PRAGMA optimize')
+    busy, log_frames, checkpointed = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+    state.update(wal_frames=log_frames, checkpointed=checkpointed)
+    return False
+
+
+def analyze(conn, options, state):
+    # analysis_limit bounds the rows sampled per index, so ANALYZE stays
+    # quick on large tables
+    conn.execute(f"PRAGMA analysis_limit = {int(options['analysis_limit'])}")
+    started = time.perf_counter()
+    conn.execute('ANALYZE')
+    conn.commit()
+    state['seconds'] = round(time.perf_counter() - started, 3)
+    return False
+
+
+def vacuum(conn, options, state):
+    # Returns free pages to the file system vacuum_pages at a time. Needs
+    # auto_vacuum=INCREMENTAL, which `flask maintenance vacuum-full` sets.
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        state['skipped'] = 'auto_vacuum is not INCREMENTAL; run `flask maintenance vacuum-full` once'
+        return False
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    state.setdefault('free_pages_before', free)
+    if not free:
+        return False
+    conn.execute(f"PRAGMA incremental_vacuum({int(options['vacuum_pages'])})").fetchall()
+    conn.commit()
+    state['free_pages'] = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return state['free_pages'] > 0
+
+
+def prune_changes(conn, options, state):
+    # Drops change feed entries older than change_retention seconds, oldest
+    # first. seq follows commit order, so the first entry that is new enough
+    # ends the run; the rest of the table is never read. The feed answers
+    # 410 to consumers that were further behind.
+    cutoff = conn.execute("SELECT datetime('now', ?)", (f"-{int(options['change_retention'])} seconds",)).fetchone()[0]
+    rows = conn.execute('SELECT seq, changed_at FROM changes WHERE seq > ? ORDER BY seq LIMIT ?',
+                        (state.get('cursor', 0), options['batch_size'])).fetchall()
+    expired = []
+    for seq, changed_at in rows:
+        if changed_at >= cutoff:
+            break
+        expired.append(seq)
+    if not expired:
+        return False
+    if not options.get('dry_run'):
+        with conn:
+            conn.execute('DELETE FROM changes WHERE seq > ? AND seq <= ?', (state.get('cursor', 0), expired[-1]))
+    state['cursor'] = expired[-1]
+    state['pruned'] = state.get('pruned', 0) + len(expired)
+    return len(expired) == options['batch_size']
+
+
+def prune_jobs(conn, options, state):
+    # Drops done and failed jobs last updated more than job_retention seconds
+    # ago, oldest first. created_at follows id order, so the first job created
+    # within the retention ends the run. Queued and running jobs are skipped.
+    cutoff = conn.execute("SELECT datetime('now', ?)", (f"-{int(options['job_retention'])} seconds",)).fetchone()[0]
+    rows = conn.execute('SELECT id, status, created_at, updated_at FROM jobs WHERE id > ? ORDER BY id LIMIT ?',
+                        (state.get('cursor', 0), options['batch_size'])).fetchall()
+    scanned = []
+    expired = []
+    for job_id, status, created_at, updated_at in rows:
+        if created_at >= cutoff:
+            break
+        scanned.append(job_id)
+        if status in ('done', 'failed') and updated_at < cutoff:
+            expired.append(job_id)
+    if not scanned:
+        return False
+    if expired and not options.get('dry_run'):
+        with conn:
+            conn.executemany("DELETE FROM jobs WHERE id = ? AND status IN ('done', 'failed')",
+                             [(job_id,) for job_id in expired])
+    state['cursor'] = scanned[-1]
+    state['pruned'] = state.get('pruned', 0) + len(expired)
+    return len(scanned) == options['batch_size']
+
+
+def integrity_check(conn, options, state):
+    problems = [row[0] for row in conn.execute('PRAGMA quick_check(100)')]
+    state['quick_check'] = problems if problems != ['ok'] else 'ok'
+    state['foreign_key_violations'] = len(conn.execute('PRAGMA foreign_key_check').fetchall())
+    if problems != ['ok'] or state['foreign_key_violations']:
+        logger.error('integrity check failed: %s', state)
+    return False
+
+
+TASKS = {
+    'cleanup_uploads': cleanup_uploads,
+    'gc_uploads': gc_uploads,
+    'reconcile_blobs': reconcile_blobs,
+    'check_references': check_references,
+    'optimize': optimize,
+    'analyze': analyze,
+    'vacuum': vacuum,
+    'integrity_check': integrity_check,
+    'prune_changes': prune_changes,
+    'prune_jobs': prune_jobs,
+}
+
+
+def run_step(conn, task, options, state):
+    # Runs one step of task; returns True if another step is needed
+    if task not in TASKS:
+        raise LookupError(f'unknown maintenance task {task!r}')
+    state.setdefault('started', time.time())
+    more = TASKS[task](conn, options, state)
+    if not more and not options.get('dry_run'):
+        finished = time.time()
+        result = {key: value for key, value in state.items() if key not in ('started', 'cursor', 'table')}
+        with conn:
+            conn.execute('''
+                INSERT INTO maintenance_runs (task, finished_at, duration, result) VALUES (?, ?, ?, ?)
+                ON CONFLICT (task) DO UPDATE SET finished_at = excluded.finished_at,
+                    duration = excluded.duration, result = excluded.result
+            ''', (task, finished, round(finished - state['started'], 3), json.dumps(result)))
+        logger.info('maintenance task %s finished: %s', task, result)
+    return more
+
+
+def run_task(conn, task, options, throttle=0.0):
+    # Runs every step of task in this thread, e.g. from the CLI
+    state = {}
+    while run_step(conn, task, options, state):
+        time.sleep(throttle)
+    return state
+
+
+def maintenance_status(conn):
+    return [{'task': task, 'scheduled_at': scheduled_at, 'finished_at': finished_at, 'duration': duration,
+             'result': json.loads(result) if result else None}
+            for task, scheduled_at, finished_at, duration, result in conn.execute(
+                'SELECT task, scheduled_at, finished_at, duration, result FROM maintenance_runs ORDER BY task')]
+
+
+def queue_due_tasks(conn, intervals):
+    # Queues a 'maintenance' job for every task whose interval has passed.
+    # The conditional upsert is the claim, so several processes can run a
+    # scheduler without queueing a task twice.
+    now = time.time()
+    queued = []
+    with conn:
+        for task, interval in intervals.items():
+            claimed = conn.execute('''
+                INSERT INTO maintenance_runs (task, scheduled_at) VALUES (?, ?)
+                ON CONFLICT (task) DO UPDATE SET scheduled_at = excluded.scheduled_at
+                WHERE maintenance_runs.scheduled_at <= ?
+            ''', (task, now, now - interval)).rowcount
+            if claimed:
+                enqueue(conn, 'maintenance', {'task': task})
+                queued.append(task)
+    return queued
+
+
+class MaintenanceScheduler:
+    # Daemon thread that calls queue_due_tasks() every check_interval seconds;
+    # on_queued is called after new jobs were committed
+    def __init__(self, database, intervals, check_interval=60.0, on_queued=None):
+        self.database = database
+        self.intervals = intervals
+        self.check_interval = check_interval
+        self.on_queued = on_queued
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name='maintenance-scheduler', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = sqlite3.connect(self.database, timeout=30)
+        try:
+            while not self._stopped.is_set():
+                try:
+                    if queue_due_tasks(conn, self.intervals) and self.on_queued:
+                        self.on_queued()
+                except sqlite3.Error:
+                    logger.exception('could not queue maintenance tasks')
+                self._stopped.wait(self.check_interval)
+        finally:
+            conn.close()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
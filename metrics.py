@@ -0,0 +1,246 @@
+import bisect
+import heapq
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+# Latency buckets in seconds, the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for le, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield le, total
+
+
+class RequestStats:
+    # SQL activity of one request, filled in by InstrumentedConnection
+    def __init__(self, slow_query_seconds):
+        self.slow_query_seconds = slow_query_seconds
+        self.durations = []
+        self.slow_queries = []
+
+    def record(self, sql, elapsed):
+        self.durations.append(elapsed)
+        if elapsed >= self.slow_query_seconds:
+            self.slow_queries.append((' '.join(sql.split())[:200], elapsed))
+
+
+class InstrumentedConnection:
+    # Wraps a pooled connection and times every statement. Only the execute
+    # call itself is timed: rows that are fetched afterwards are stepped
+    # lazily by SQLite and not included.
+    def __init__(self, connection, stats):
+        self.connection = connection
+        self.stats = stats
+
+    def _timed(self, method, sql, *args):
+        started = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            self.stats.record(sql, time.perf_counter() - started)
+
+    def execute(self, sql, *args):
+        return self._timed(self.connection.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(self.connection.executemany, sql, *args)
+
+    def executescript(self, sql):
+        return self._timed(self.connection.executescript, sql)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def __enter__(self):
+        self.connection.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.connection.__exit__(*exc_info)
+
+
+class SamplingProfiler:
+    # Samples the stacks of the threads currently serving a request every
+    # interval seconds. Requests slower than threshold seconds are written to
+    # directory as folded stacks ("frame;frame;frame count" per line), the
+    # input format of flamegraph.pl and speedscope. Only the keep slowest
+    # files are kept.
+    def __init__(self, directory, interval=0.005, threshold=0.5, keep=20):
+        self.directory = directory
+        self.interval = interval
+        self.threshold = threshold
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._active = {}
+        self._slowest = []
+        self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[fold_stack(frame)] += 1
+
+    def begin(self):
+        if self._thread is None:
+            self._start()
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+
+    def end(self, name, elapsed):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if not samples or elapsed < self.threshold:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{elapsed * 1000:.0f}ms-{name}.folded")
+        with open(filename, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        with self._lock:
+            heapq.heappush(self._slowest, (elapsed, filename))
+            dropped = heapq.heappop(self._slowest) if len(self._slowest) > self.keep else None
+        if dropped is not None:
+            try:
+                os.remove(dropped[1])
+            except OSError:
+                pass
+        return filename
+
+
+def fold_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class Metrics:
+    # Per-endpoint request latency and SQL statistics, rendered in the
+    # Prometheus text exposition format by render()
+    def __init__(self, slow_query_seconds=0.1):
+        self.slow_query_seconds = slow_query_seconds
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.statuses = Counter()
+        self.queries = {}
+        self.query_durations = {}
+        self.slow_queries = Counter()
+
+    def start_request(self):
+        return RequestStats(self.slow_query_seconds)
+
+    def finish_request(self, endpoint, method, status, elapsed, stats):
+        with self._lock:
+            key = (endpoint, method)
+            if key not in self.requests:
+                self.requests[key] = Histogram()
+                self.queries[key] = Histogram(buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+                self.query_durations[key] = Histogram(buckets=SQL_BUCKETS)
+            self.requests[key].observe(elapsed)
+            self.queries[key].observe(len(stats.durations))
+            for duration in stats.durations:
+                self.query_durations[key].observe(duration)
+            self.statuses[(endpoint, method, str(status))] += 1
+            self.slow_queries[key] += len(stats.slow_queries)
+
+    def render(self, gauges=()):
+        # gauges are (name, help, {labels: value}) with labels a tuple of
+        # (label, value) pairs, () for none
+        lines = []
+        with self._lock:
+            lines += histogram_lines('http_request_duration_seconds', 'Request latency by endpoint',
+                                     self.requests, ('endpoint', 'method'))
+            lines += counter_lines('http_requests_total', 'Requests by endpoint and status',
+                                   self.statuses, ('endpoint', 'method', 'status'))
+            lines += histogram_lines('sql_queries_per_request', 'SQL statements executed per request',
+                                     self.queries, ('endpoint', 'method'))
+            lines += histogram_lines('sql_query_duration_seconds', 'Duration of single SQL statements',
+                                     self.query_durations, ('endpoint', 'method'))
+            lines += counter_lines('sql_slow_queries_total', 'SQL statements slower than the slow query threshold',
+                                   self.slow_queries, ('endpoint', 'method'))
+        for name, help_text, values in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in values.items():
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (f'{name}="{escape_label(value)}"' for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+def histogram_lines(name, help_text, histograms, label_names):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for key, histogram in sorted(histograms.items()):
+        labels = tuple(zip(label_names, key))
+        for le, count in histogram.cumulative():
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", format_value(float(le))),))} {count}')
+        lines.append(f'{name}_sum{format_labels(labels)} {format_value(float(histogram.sum))}')
+        lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+    return lines
+
+
+def counter_lines(name, help_text, counter, label_names):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+    for key, value in sorted(counter.items()):
+        lines.append(f'{name}{format_labels(tuple(zip(label_names, key)))} {format_value(value)}')
+    return lines
+
+
+def stats_gauges(prefix, help_text, stats):
+    # Turns a flat stats() dict such as ConnectionPool.stats() into gauges
+    gauges = []
+    for key, value in sorted(stats.items()):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            name = re.sub(r'[^a-zA-Z0-9_]', '_', f'{prefix}_{key}')
+            gauges.append((name, f'{help_text}: {key}', {(): value}))
+    return gauges
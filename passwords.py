@@ -0,0 +1,26 @@
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+def normalize_method(method):
+    # Werkzeug stores "pbkdf2:sha256" as "pbkdf2:sha256:<default iterations>"
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2' and len(parts) == 2:
+        return f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
+
+
+class PasswordPolicy:
+    # The hash method new passwords get. Hashes made under an older policy
+    # still verify and are upgraded the next time their owner logs in.
+    def __init__(self, method='pbkdf2:sha256', salt_length=16):
+        self.method = normalize_method(method)
+        self.salt_length = salt_length
+
+    def hash(self, password):
+        return generate_password_hash(password, method=self.method, salt_length=self.salt_length)
+
+    def verify(self, password_hash, password):
+        return check_password_hash(password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
@@ -0,0 +1,158 @@
+# SQL of the routes' read paths. The routes run these strings and
+# PLAN_CHECKS runs EXPLAIN QUERY PLAN on the same ones, so `flask
+# check-query-plans` and tests/test_query_plans.py see every change to a
+# query. Queries with optional filters are built by the functions below
+# from the conditions that apply, each ending in a `?` placeholder.
+from db import find_table_scans
+from importer import STUDENT_FIELDS
+
+# Dashboard and /api/student_stats, from the student_counts summary table
+DASHBOARD_SCHOOLS = 'SELECT DISTINCT school FROM student_counts'
+DASHBOARD_DEPARTMENTS = 'SELECT DISTINCT department FROM student_counts'
+DASHBOARD_TOTAL = 'SELECT COALESCE(SUM(count), 0) FROM student_counts'
+SCHOOL_DEPARTMENTS = 'SELECT department FROM student_counts WHERE school = ?'
+SCHOOL_TOTAL = 'SELECT COALESCE(SUM(count), 0) FROM student_counts WHERE school = ?'
+DEPARTMENT_TOTAL = 'SELECT COALESCE(SUM(count), 0) FROM student_counts WHERE department = ?'
+RECENT_STUDENTS = '''
+    SELECT student_id, name, department, created_at
+    FROM students
+    ORDER BY created_at DESC
+    LIMIT 5
+'''
+STATS_ALL = '''
+    SELECT school, department, count
+    FROM student_counts
+    ORDER BY school, department
+'''
+STATS_SCHOOL = '''
+    SELECT department, count
+    FROM student_counts
+    WHERE school = ?
+    ORDER BY department
+'''
+STATS_DEPARTMENT = 'SELECT COALESCE(SUM(count), 0) as count FROM student_counts WHERE department = ?'
+
+# Single students and documents
+STUDENT_EXISTS = 'SELECT 1 FROM students WHERE student_id = ?'
+STUDENT = 'SELECT * FROM students WHERE student_id = ?'
+STUDENT_SCOPE = 'SELECT school, department FROM students WHERE student_id = ?'
+FILE_OWNERS = '''
+    SELECT student_id FROM documents WHERE document_path = ?
+    UNION
+    SELECT student_id FROM students WHERE photo_path = ? AND photo_path IS NOT NULL
+'''
+STUDENT_DOCUMENTS = 'SELECT * FROM documents WHERE student_id = ?'
+DOCUMENT = 'SELECT * FROM documents WHERE id = ?'
+DOCUMENT_BY_PATH = 'SELECT student_id, document_name FROM documents WHERE document_path = ? LIMIT 1'
+
+# /api/changes
+CHANGES_PAGE = 'SELECT * FROM changes WHERE seq > ? ORDER BY seq LIMIT ?'
+CHANGES_OLDEST = 'SELECT MIN(seq) FROM changes'
+CHANGES_LAST = "SELECT seq FROM sqlite_sequence WHERE name = 'changes'"
+
+
+def where(conditions, prefix=''):
+    return ''.join(f' AND {prefix}{condition}' for condition in conditions)
+
+
+def student_page(conditions):
+    # /api/students, newest first; conditions such as 'school = ?' or
+    # '(created_at, id) < (?, ?)' for the cursor, then the LIMIT
+    return ('SELECT id, student_id, name, email, phone, department, school, created_at FROM students WHERE 1 = 1'
+            + where(conditions) + ' ORDER BY created_at DESC, id DESC LIMIT ?')
+
+
+def student_lookup(conditions):
+    # POST /search: STUDENT restricted to the caller's scope
+    return STUDENT + where(conditions)
+
+
+def student_search(conditions):
+    # /api/search: the MATCH, the scope conditions on s, then the LIMIT
+    return f'''
+        SELECT s.student_id, s.name, s.email, s.phone, s.department, s.school
+        FROM student_search
+        JOIN students s ON s.id = student_search.rowid
+        WHERE student_search MATCH ?{where(conditions, 's.')}
+        ORDER BY student_search.rank LIMIT ?
+    '''
+
+
+def roster_batch(conditions):
+    # Exports: one batch of students in scope after the last id
+    return f'''
+        SELECT s.id, {', '.join('s.' + field for field in STUDENT_FIELDS)}, s.created_at,
+               (SELECT COUNT(*) FROM documents d WHERE d.student_id = s.student_id) AS documents
+        FROM students s
+        WHERE 1 = 1{where(conditions, 's.')} AND s.id > ?
+        ORDER BY s.id LIMIT ?
+    '''
+
+
+def document_batch(conditions):
+    # /export/documents.zip: one batch of documents of students in scope
+    return f'''
+        SELECT d.id, d.student_id, d.document_name, d.document_path, d.upload_date
+        FROM documents d
+        JOIN students s ON s.student_id = d.student_id
+        WHERE 1 = 1{where(conditions, 's.')} AND d.id > ?
+        ORDER BY d.id LIMIT ?
+    '''
+
+
+SCHOOL = 'school = ?'
+DEPARTMENT = 'department = ?'
+CREATED_FROM = 'created_at >= ?'
+CREATED_TO = 'created_at < ?'
+BEFORE_CURSOR = '(created_at, id) < (?, ?)'
+
+PLAN_CHECKS = [
+    ('dashboard: all schools', DASHBOARD_SCHOOLS, ()),
+    ('dashboard: all departments', DASHBOARD_DEPARTMENTS, ()),
+    ('dashboard: all students total', DASHBOARD_TOTAL, ()),
+    ('dashboard: school departments', SCHOOL_DEPARTMENTS, ('Engineering',)),
+    ('dashboard: school total', SCHOOL_TOTAL, ('Engineering',)),
+    ('dashboard: department total', DEPARTMENT_TOTAL, ('CSE',)),
+    ('dashboard: recent students', RECENT_STUDENTS, ()),
+    ('student_stats: super admin', STATS_ALL, ()),
+    ('student_stats: school', STATS_SCHOOL, ('Engineering',)),
+    ('student_stats: department', STATS_DEPARTMENT, ('CSE',)),
+    ('insert_student: existing id', STUDENT_EXISTS, ('ENG001',)),
+    ('student scope', STUDENT_SCOPE, ('ENG001',)),
+    ('file owners', FILE_OWNERS, ('x.pdf', 'x.pdf')),
+    ('list_students: first page', student_page([]), (51,)),
+    ('list_students: school page', student_page([SCHOOL, BEFORE_CURSOR]), ('Engineering', '2025-01-01', 10, 51)),
+    ('list_students: department range', student_page([DEPARTMENT, CREATED_FROM, BEFORE_CURSOR]),
+     ('CSE', '2024-01-01', '2025-01-01', 10, 51)),
+    ('search_student: school', student_lookup([SCHOOL]), ('ENG001', 'Engineering')),
+    ('search_student: documents', STUDENT_DOCUMENTS, ('ENG001',)),
+    ('api_search: all', student_search([]), ('"ada"*', 20)),
+    ('api_search: department', student_search([DEPARTMENT]), ('"ada"*', 'CSE', 20)),
+    ('export roster: all', roster_batch([]), (0, 1000)),
+    ('export roster: department', roster_batch([DEPARTMENT]), ('CSE', 0, 1000)),
+    ('export documents: school', document_batch([SCHOOL]), ('Engineering', 0, 1000)),
+    ('export documents: department', document_batch([DEPARTMENT]), ('CSE', 0, 1000)),
+    ('changes: page', CHANGES_PAGE, (0, 500)),
+    ('changes: oldest', CHANGES_OLDEST, ()),
+    ('changes: last', CHANGES_LAST, ()),
+    ('delete_document: document', DOCUMENT, (1,)),
+    ('download name', DOCUMENT_BY_PATH, ('x.pdf',)),
+]
+
+FULL_SCAN_ALLOWED = {
+    'dashboard: all schools',
+    'dashboard: all departments',
+    'dashboard: all students total',
+    'dashboard: recent students',  # ordered walk of idx_students_created_at, stops after LIMIT
+    'student_stats: super admin',
+    'list_students: first page',  # ordered walk of idx_students_created_at, stops after LIMIT
+    'changes: last',  # sqlite_sequence has a row per AUTOINCREMENT table
+}
+
+
+def check_query_plans(conn):
+    # (name, table scans, allowed) for every entry of PLAN_CHECKS
+    results = []
+    for name, sql, params in PLAN_CHECKS:
+        results.append((name, find_table_scans(conn, sql, params), name in FULL_SCAN_ALLOWED))
+    return results
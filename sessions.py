@@ -0,0 +1,264 @@
+import json
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.previous_sid = None
+
+    def regenerate(self):
+        # New ID for the same data, e.g. after login, so an ID handed out
+        # before authentication cannot be reused
+        if self.sid and not self.new:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class SessionStore:
+    # Stores hold the JSON-encoded session dict per ID and record how long
+    # lookups take so that the backend can be compared under load.
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.lookups = 0
+        self.lookup_time = 0.0
+        self.lookup_max = 0.0
+
+    def load(self, sid):
+        started = time.perf_counter()
+        try:
+            return self._load(sid)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self.lookups += 1
+                self.lookup_time += elapsed
+                self.lookup_max = max(self.lookup_max, elapsed)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'lookups': self.lookups,
+                'lookup_avg_ms': round(self.lookup_time / self.lookups * 1000, 4) if self.lookups else 0.0,
+                'lookup_max_ms': round(self.lookup_max * 1000, 4),
+            }
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    # Single-process store; sessions are lost on restart
+    def __init__(self, maxsize=10000):
+        super().__init__()
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            expires, username, data = entry
+            if expires < time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return json.loads(data)
+
+    def save(self, sid, data, expires):
+        with self._lock:
+            self._data[sid] = (expires, data.get('username'), json.dumps(data))
+            self._data.move_to_end(sid)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def delete_user(self, username):
+        with self._lock:
+            sids = [sid for sid, entry in self._data.items() if entry[1] == username]
+            for sid in sids:
+                del self._data[sid]
+        return len(sids)
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, entry in self._data.items() if entry[0] < now]
+            for sid in expired:
+                del self._data[sid]
+        return len(expired)
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats['sessions'] = len(self._data)
+        return stats
+
+
+class SQLiteSessionStore(SessionStore):
+    # Store shared by every worker on the host. Each worker keeps recently
+    # read sessions for local_ttl seconds, so a revoked session stays usable
+    # on another worker for at most that long.
+    def __init__(self, path, local_cache_size=1024, local_ttl=5.0):
+        super().__init__()
+        self.local_ttl = local_ttl
+        self.local_cache_size = local_cache_size
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                username TEXT,
+                data TEXT NOT NULL,
+                expires REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_username ON sessions (username);
+            CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires);
+        ''')
+
+    def _load(self, sid):
+        now = time.time()
+        with self._lock:
+            entry = self._local.get(sid)
+            if entry is not None and entry[0] > time.monotonic() and entry[1] > now:
+                self._local.move_to_end(sid)
+                return json.loads(entry[2])
+            row = self._conn.execute('SELECT data, expires FROM sessions WHERE id = ?', (sid,)).fetchone()
+            if row is None or row[1] < now:
+                self._local.pop(sid, None)
+                return None
+            self._remember(sid, row[1], row[0])
+            return json.loads(row[0])
+
+    def _remember(self, sid, expires, data):
+        self._local[sid] = (time.monotonic() + self.local_ttl, expires, data)
+        self._local.move_to_end(sid)
+        while len(self._local) > self.local_cache_size:
+            self._local.popitem(last=False)
+
+    def save(self, sid, data, expires):
+        encoded = json.dumps(data)
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO sessions (id, username, data, expires) VALUES (?, ?, ?, ?)',
+                               (sid, data.get('username'), encoded, expires))
+            self._remember(sid, expires, encoded)
+
+    def delete(self, sid):
+        with self._lock:
+            self._conn.execute('DELETE FROM sessions WHERE id = ?', (sid,))
+            self._local.pop(sid, None)
+
+    def delete_user(self, username):
+        with self._lock:
+            sids = [row[0] for row in self._conn.execute('SELECT id FROM sessions WHERE username = ?', (username,))]
+            self._conn.execute('DELETE FROM sessions WHERE username = ?', (username,))
+            for sid in sids:
+                self._local.pop(sid, None)
+        return len(sids)
+
+    def sweep(self):
+        with self._lock:
+            return self._conn.execute('DELETE FROM sessions WHERE expires < ?', (time.time(),)).rowcount
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats['sessions'] = self._conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+            stats['local_cache'] = len(self._local)
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ServerSideSessionInterface(SessionInterface):
+    # The cookie only carries a random session ID; the data stays in the
+    # store. get_store is called per request so the store can be created
+    # lazily from the app config.
+    def __init__(self, get_store, sweep_interval=300):
+        self.get_store = get_store
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _start_sweeper(self):
+        # Expired sessions are removed in the background, never on a request
+        if self._sweeper is not None:
+            return
+        with self._sweeper_lock:
+            if self._sweeper is not None or not self.sweep_interval:
+                return
+
+            def sweep():
+                while not self._stopped.wait(self.sweep_interval):
+                    try:
+                        self.get_store().sweep()
+                    except sqlite3.Error:
+                        pass
+
+            self._sweeper = threading.Thread(target=sweep, name='session-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def open_session(self, app, request):
+        self._start_sweeper()
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            data = self.get_store().load(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(new=True)
+
+    def save_session(self, app, session, response):
+        store = self.get_store()
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid:
+            store.delete(session.previous_sid)
+            session.previous_sid = None
+
+        if not session:
+            if session.modified and session.sid:
+                store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        if not session.modified:
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(32)
+        expires = time.time() + app.permanent_session_lifetime.total_seconds()
+        store.save(session.sid, dict(session), expires)
+        response.set_cookie(app.session_cookie_name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import re
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+# ab/cd/<sha256>.<ext>
+BLOB_PATH_RE = re.compile(r'^([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})\.[a-z0-9]+$')
+
+
+# Leading bytes expected for each allowed upload type. docx is a zip archive
+# and doc an OLE compound file.
+MAGIC_NUMBERS = {
+    'pdf': (b'%PDF-',),
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'gif': (b'GIF87a', b'GIF89a'),
+    'doc': (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1',),
+    'docx': (b'PK\x03\x04',),
+}
+
+
+def matches_magic(ext, head):
+    signatures = MAGIC_NUMBERS.get(ext.lower())
+    return signatures is not None and head.startswith(signatures)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_digest(path):
+    # The sha256 of a content-addressed path, or None for a legacy flat file
+    match = BLOB_PATH_RE.match(path)
+    return match.group(3) if match else None
+
+
+class BlobStore:
+    # Content-addressed upload storage. Files are hashed while they are
+    # streamed to disk and stored once under a sharded ab/cd/<sha256>.<ext>
+    # path; the blobs table counts how many rows reference each path.
+    #
+    # save() and release() only change the blobs table, so callers commit
+    # them in the same transaction as their documents/students write. Files
+    # are removed by discard() after that commit, and only when no row
+    # references them any more.
+    def __init__(self, root):
+        self.root = root
+
+    def full_path(self, path):
+        return os.path.join(self.root, *path.split('/'))
+
+    def save(self, conn, stream, ext):
+        tmp_dir = os.path.join(self.root, '.tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            return self.adopt(conn, tmp_path, digest.hexdigest(), size, ext)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def adopt(self, conn, tmp_path, sha256, size, ext):
+        # Moves an already hashed temporary file into place, or drops it if
+        # the same content is stored already. The blobs row goes in first:
+        # that takes the database write lock, which the orphan-file collector
+        # in maintenance.py holds while it deletes, so the file cannot vanish
+        # between the existence check and the caller's commit.
+        path = f'{sha256[:2]}/{sha256[2:4]}/{sha256}.{ext.lower()}'
+        conn.execute('''
+            INSERT INTO blobs (path, size, refcount) VALUES (?, ?, 1)
+            ON CONFLICT (path) DO UPDATE SET refcount = refcount + 1
+        ''', (path, size))
+        target = self.full_path(path)
+        if os.path.exists(target):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+        return path
+
+    def release(self, conn, path):
+        # Drops one reference; returns True when nothing references the file
+        # any more and it should be discarded once the caller has committed.
+        if blob_digest(path) is None:
+            # Flat file from before content-addressed storage, never shared
+            return True
+        conn.execute('UPDATE blobs SET refcount = refcount - 1 WHERE path = ?', (path,))
+        conn.execute('DELETE FROM blobs WHERE path = ? AND refcount <= 0', (path,))
+        return conn.execute('SELECT 1 FROM blobs WHERE path = ?', (path,)).fetchone() is None
+
+    def discard(self, conn, path):
+        # Someone may have uploaded the same content again since release().
+        # Checked and deleted under the write lock, which adopt() takes with
+        # its blobs row, so an adopt of the same content that has not
+        # committed yet is waited for instead of losing its file.
+        if blob_digest(path) is None:
+            return self._remove(path)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT 1 FROM blobs WHERE path = ?', (path,)).fetchone():
+                return False
+            return self._remove(path)
+        finally:
+            conn.commit()
+
+    def _remove(self, path):
+        try:
+            os.remove(self.full_path(path))
+        except OSError:
+            return False
+        return True
@@ -0,0 +1,52 @@
+import io
+
+import pytest
+
+from app import close_resources, create_app, init_db
+
+
+@pytest.fixture
+def config(tmp_path):
+    # Every file the app writes goes to tmp_path; the database does not exist yet
+    return {
+        'TESTING': True,
+        'DATABASE': str(tmp_path / 'database.db'),
+        'SESSION_DB_PATH': str(tmp_path / 'sessions.db'),
+        'STATS_CACHE_PATH': str(tmp_path / 'cache.db'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'PROFILER_DIR': str(tmp_path / 'profiles'),
+        'JOB_WORKERS': 0,
+    }
+
+
+@pytest.fixture
+def app(config):
+    # A migrated and seeded database
+    app = create_app(config)
+    init_db()
+    yield app
+    close_resources()
+
+
+@pytest.fixture
+def login(app):
+    # login(username, password) returns a test client signed in as that user
+    def login(username, password):
+        client = app.test_client()
+        assert client.post('/login', data={'username': username, 'password': password}).status_code == 302
+        return client
+    return login
+
+
+@pytest.fixture
+def add_student():
+    # add_student(client, student_id, department) posts the /insert form;
+    # photo is (content, filename)
+    def add_student(client, student_id, department, school='Engineering', photo=None):
+        content, filename = photo or (b'', '')
+        return client.post('/insert', data={
+            'student_id': student_id, 'name': f'Student {student_id}', 'email': f'{student_id.lower()}@example.edu',
+            'phone': '5550100', 'department': department, 'school': school,
+            'photo': (io.BytesIO(content), filename),
+        })
+    return add_student
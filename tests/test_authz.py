@@ -0,0 +1,57 @@
+import sqlite3
+import time
+
+import pytest
+
+from app import get_authorizer
+
+PHOTO = (b'\x89PNG\r\n\x1a\n' + b'\x00' * 64, 'photo.png')
+
+
+@pytest.fixture
+def short_file_ttl(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'AUTHZ_FILE_TTL', 0.5)
+
+
+@pytest.fixture
+def photo_path(app, login, add_student):
+    add_student(login('eee_admin', 'admin123'), 'ENG200', 'EEE', photo=PHOTO)
+    conn = sqlite3.connect(app.config['DATABASE'])
+    path = conn.execute("SELECT photo_path FROM students WHERE student_id = 'ENG200'").fetchone()[0]
+    conn.close()
+    assert path
+    # Cached as belonging to ENG200 alone
+    with app.app_context():
+        conn = sqlite3.connect(app.config['DATABASE'])
+        assert get_authorizer().file_owners(conn, path) == ('ENG200',)
+        conn.close()
+    return path
+
+
+def test_shared_photo_is_readable_once_added_here(app, login, add_student, photo_path):
+    cse = login('cse_admin', 'admin123')
+    add_student(cse, 'ENG201', 'CSE', photo=PHOTO)
+    with app.app_context():
+        assert get_authorizer().stats()['files'] == 0
+    assert cse.get(f'/view_document/{photo_path}').status_code == 200
+
+
+def test_shared_photo_is_readable_once_added_by_another_worker(app, login, photo_path):
+    cse = login('cse_admin', 'admin123')
+    # Written behind this process's back, so its cached owners are stale
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.execute("INSERT INTO students (student_id, name, department, school, photo_path) "
+                 "VALUES ('ENG201', 'ENG201', 'CSE', 'Engineering', ?)", (photo_path,))
+    conn.commit()
+    conn.close()
+    assert cse.get(f'/view_document/{photo_path}').status_code == 200
+
+
+def test_photo_removed_by_another_worker_stops_being_readable(app, short_file_ttl, login, photo_path):
+    eee = login('eee_admin', 'admin123')
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.execute("UPDATE students SET photo_path = NULL WHERE student_id = 'ENG200'")
+    conn.commit()
+    conn.close()
+    time.sleep(0.6)
+    assert eee.get(f'/view_document/{photo_path}').status_code == 404
@@ -0,0 +1,23 @@
+import sqlite3
+
+from app import maintenance_options
+from maintenance import run_task
+
+
+def test_prune_jobs_drops_only_old_finished_jobs(app):
+    conn = sqlite3.connect(app.config['DATABASE'])
+    old = "datetime('now', '-30 days')"
+    conn.executescript(f'''
+        INSERT INTO jobs (kind, payload, status, run_after, created_at, updated_at) VALUES
+            ('thumbnail', '{{}}', 'done', 0, {old}, {old}),
+            ('thumbnail', '{{}}', 'failed', 0, {old}, {old}),
+            ('thumbnail', '{{}}', 'queued', 0, {old}, {old}),
+            ('thumbnail', '{{}}', 'done', 0, {old}, CURRENT_TIMESTAMP),
+            ('thumbnail', '{{}}', 'done', 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP);
+    ''')
+    with app.app_context():
+        options = dict(maintenance_options(), batch_size=2)
+    state = run_task(conn, 'prune_jobs', options)
+    assert state['pruned'] == 2
+    assert [row[0] for row in conn.execute('SELECT id FROM jobs ORDER BY id')] == [3, 4, 5]
+    conn.close()
@@ -0,0 +1,39 @@
+import sqlite3
+
+import pytest
+
+from queries import check_query_plans
+
+SCOPES = [('Engineering', 'CSE'), ('Engineering', 'EEE'), ('Engineering', 'MECH'),
+          ('Arts', 'History'), ('Arts', 'English'), ('Science', 'Physics')]
+
+
+@pytest.fixture
+def conn(app):
+    # A few thousand students, one in fifty with a photo and one in ten with
+    # a document, so the statistics look like a real campus and not like the
+    # seed data
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.executemany('''
+        INSERT INTO students (student_id, name, email, phone, department, school, photo_path, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, datetime('2024-01-01', ? || ' minutes'))
+    ''', [(f'S{i:05d}', f'Student {i}', f's{i}@example.edu', '555-0100', SCOPES[i % len(SCOPES)][1],
+           SCOPES[i % len(SCOPES)][0], f'photo{i}.jpg' if i % 50 == 0 else None, i)
+          for i in range(3000)])
+    conn.executemany('INSERT INTO documents (student_id, document_name, document_path) VALUES (?, ?, ?)',
+                     [(f'S{i:05d}', 'Transcript', f'doc{i}.pdf') for i in range(0, 3000, 10)])
+    conn.commit()
+    conn.execute('ANALYZE')
+    yield conn
+    conn.close()
+
+
+def test_no_unexpected_table_scans(conn):
+    failures = [f"{name}: {'; '.join(scans)}" for name, scans, allowed in check_query_plans(conn)
+                if scans and not allowed]
+    assert not failures
+
+
+def test_fts_match_is_not_a_scan(conn):
+    results = dict((name, scans) for name, scans, allowed in check_query_plans(conn))
+    assert results['api_search: all'] == []
@@ -0,0 +1,45 @@
+import io
+
+import pytest
+
+from app import close_resources, create_app
+
+
+@pytest.fixture
+def app(config):
+    # Nothing migrated or seeded yet: the first request does both
+    app = create_app(config)
+    yield app
+    close_resources()
+
+
+def test_fresh_database_has_the_default_catalog(login):
+    catalog = login('superadmin', 'superadmin123').get('/api/catalog').get_json()
+    assert sorted(catalog['Engineering']) == ['CSE', 'EEE', 'Mech']
+    assert sorted(catalog['Arts']) == ['B.Com', 'B.Sc (CS)', 'BCA', 'Economics']
+
+
+def test_department_admin_can_insert_on_a_fresh_database(login, add_student):
+    client = login('cse_admin', 'admin123')
+    response = add_student(client, 'ENG100', 'CSE')
+    assert response.headers['Location'].endswith('/dashboard')
+    students = client.get('/api/students').get_json()['students']
+    assert 'ENG100' in [student['student_id'] for student in students]
+
+
+def test_department_admin_can_import_on_a_fresh_database(login):
+    data = b'student_id,name,email,phone,department,school\nENG101,Alan Turing,alan@example.com,5550101,CSE,Engineering\n'
+    report = login('cse_admin', 'admin123').post('/import', data={'file': (io.BytesIO(data), 'students.csv')}).get_json()
+    assert (report['imported'], report['failed']) == (1, 0), report
+
+
+def test_import_reports_undecodable_rows_and_keeps_going(app, login):
+    rows = [f'SCI{n:03},Student {n},,,Physics,Science'.encode() for n in range(1, 9)]
+    rows[4] = b'SCI005,Bad \xff Byte,,,Physics,Science'
+    data = b'student_id,name,email,phone,department,school\n' + b'\n'.join(rows) + b'\n'
+    app.config['IMPORT_BATCH_SIZE'] = 2
+    client = login('superadmin', 'superadmin123')
+    report = client.post('/import', data={'file': (io.BytesIO(data), 'students.csv')}).get_json()
+    assert (report['imported'], report['failed']) == (7, 1), report
+    assert report['errors'] == [{'line': 6, 'student_id': None, 'error': 'Not valid UTF-8'}]
+    assert 'Physics' in client.get('/api/catalog').get_json()['Science']
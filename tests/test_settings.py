@@ -0,0 +1,25 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def flask(args, cwd, settings):
+    env = dict(os.environ, FLASK_APP=os.path.join(ROOT, 'app.py'), STUDENT_MGMT_SETTINGS=str(settings),
+               PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, '-m', 'flask'] + args, cwd=cwd, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def test_cli_uses_the_settings_file(tmp_path):
+    database = tmp_path / 'other.db'
+    settings = tmp_path / 'settings.py'
+    settings.write_text(f'DATABASE = {str(database)!r}\nAUTO_MIGRATE = False\n')
+    flask(['migrate'], tmp_path, settings)
+    flask(['seed'], tmp_path, settings)
+    assert not (tmp_path / 'database.db').exists()
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT COUNT(*) FROM users WHERE username = 'superadmin'").fetchone()[0] == 1
+    conn.close()
@@ -0,0 +1,33 @@
+import pytest
+
+from app import close_resources, create_app, get_replicas, init_db
+
+
+@pytest.fixture
+def app(config, tmp_path):
+    # A replica that is only refreshed when the test says so
+    config.update(DATABASE_REPLICAS=[str(tmp_path / 'replica.db')], REPLICA_REFRESH_INTERVAL=0,
+                  REPLICA_MAX_LAG=3600)
+    app = create_app(config)
+    init_db()
+    with app.app_context():
+        get_replicas()[0].refresh()
+    yield app
+    close_resources()
+
+
+def cse_count(client):
+    stats = client.get('/api/student_stats').get_json()
+    return stats['data'][stats['labels'].index('Engineering - CSE')]
+
+
+def test_stats_are_refilled_from_the_primary_not_a_stale_replica(login, add_student):
+    admin = login('superadmin', 'superadmin123')
+    before = cse_count(admin)
+    add_student(login('cse_admin', 'admin123'), 'ENG300', 'CSE')
+    assert cse_count(admin) == before + 1
+
+
+def test_stats_labels_name_the_school_only_for_super_admins(login):
+    assert 'Engineering - CSE' in login('superadmin', 'superadmin123').get('/api/student_stats').get_json()['labels']
+    assert 'CSE' in login('eng_admin', 'admin123').get('/api/student_stats').get_json()['labels']
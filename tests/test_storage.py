@@ -0,0 +1,36 @@
+import hashlib
+import io
+import sqlite3
+import threading
+import time
+
+from storage import BlobStore
+
+
+def test_discard_waits_for_an_adopt_of_the_same_content(app, tmp_path):
+    store = BlobStore(str(tmp_path / 'blobs'))
+    content = b'%PDF-1.4\nsame content'
+    first = sqlite3.connect(app.config['DATABASE'], check_same_thread=False)
+    path = store.save(first, io.BytesIO(content), 'pdf')
+    first.commit()
+    assert store.release(first, path)
+    first.commit()
+
+    # Another request stores the same content again and has not committed
+    second = sqlite3.connect(app.config['DATABASE'])
+    tmp = tmp_path / 'upload'
+    tmp.write_bytes(content)
+    assert store.adopt(second, str(tmp), hashlib.sha256(content).hexdigest(), len(content), 'pdf') == path
+
+    results = []
+    discard = threading.Thread(target=lambda: results.append(store.discard(first, path)))
+    discard.start()
+    time.sleep(0.2)
+    second.commit()
+    discard.join()
+    assert results == [False]
+    with open(store.full_path(path), 'rb') as f:
+        assert f.read() == content
+    first.close()
+    second.close()
+
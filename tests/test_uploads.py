@@ -0,0 +1,85 @@
+import io
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from thumbnails import thumbnail_format, thumbnail_path
+
+CONTENT = b'%PDF-1.4\n' + os.urandom(291)
+
+
+@pytest.fixture
+def upload(login):
+    # upload(size) -> (client, upload_id) for a resumable upload of ENG001
+    def upload(size):
+        client = login('superadmin', 'superadmin123')
+        response = client.post('/api/uploads', json={'student_id': 'ENG001', 'filename': 'notes.pdf', 'size': size})
+        assert response.status_code == 201
+        return client, response.get_json()['upload_id']
+    return upload
+
+
+def put(client, upload_id, offset, data, **kwargs):
+    return client.put(f'/api/uploads/{upload_id}', data=data, headers={'Upload-Offset': str(offset)}, **kwargs)
+
+
+class StalledStream(io.BytesIO):
+    # Request body that stops after its first 16 bytes until released, like
+    # a client whose connection dropped mid-chunk
+    def __init__(self, data):
+        super().__init__(data)
+        self.stalled = threading.Event()
+        self.released = threading.Event()
+
+    def read(self, size=-1):
+        if self.tell() >= 16:
+            self.stalled.set()
+            self.released.wait(10)
+        return super().read(size)
+
+
+def test_stale_chunk_does_not_overwrite_a_retried_one(app, login, upload):
+    client, upload_id = upload(len(CONTENT))
+    stale = StalledStream(b'%PDF-1.4\n' + b'x' * 91)
+    results = []
+    worker = threading.Thread(target=lambda: results.append(
+        put(login('superadmin', 'superadmin123'), upload_id, 0, None, input_stream=stale)))
+    worker.start()
+    assert stale.stalled.wait(10)
+
+    # The client gave up on that PUT and resumes from the committed offset
+    assert put(client, upload_id, 0, CONTENT[:100]).status_code == 200
+    assert put(client, upload_id, 100, CONTENT[100:200]).status_code == 200
+    stale.released.set()
+    worker.join()
+    assert results[0].status_code == 409
+
+    response = put(client, upload_id, 200, CONTENT[200:])
+    assert response.status_code == 201
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], *response.get_json()['document_path'].split('/')), 'rb') as f:
+        assert f.read() == CONTENT
+
+
+def test_chunk_larger_than_max_content_length_is_refused(app, upload, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 200)
+    client, upload_id = upload(len(CONTENT))
+    response = put(client, upload_id, 0, CONTENT)
+    assert response.status_code == 413
+    assert response.get_json()['offset'] == 0
+
+
+def test_document_preview_is_shown_once_generated(app, login):
+    client = login('superadmin', 'superadmin123')
+    client.post('/upload_document/ENG001', data={'document_name': 'Notes', 'document': (io.BytesIO(CONTENT), 'notes.pdf')})
+    conn = sqlite3.connect(app.config['DATABASE'])
+    path = conn.execute("SELECT document_path FROM documents WHERE document_name = 'Notes'").fetchone()[0]
+    conn.close()
+    assert f'/thumbnail/{path}' not in client.post('/search', data={'student_id': 'ENG001'}).get_data(as_text=True)
+    with app.app_context():
+        thumb = thumbnail_path(path, thumbnail_format(app.config['THUMBNAIL_FORMAT']))
+    thumb = os.path.join(app.config['UPLOAD_FOLDER'], *thumb.split('/'))
+    os.makedirs(os.path.dirname(thumb), exist_ok=True)
+    open(thumb, 'wb').close()
+    assert f'/thumbnail/{path}' in client.post('/search', data={'student_id': 'ENG001'}).get_data(as_text=True)
@@ -0,0 +1,99 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+
+# Pillow renders the thumbnails. PDF previews additionally need PyMuPDF or
+# poppler's pdftoppm. Without them the job finishes without a thumbnail and
+# the views keep serving the original upload. Both are imported on first
+# use rather than with this module, which keeps them out of worker startup.
+Image = features = fitz = None
+_imported = False
+
+
+def import_renderers():
+    global Image, features, fitz, _imported
+    if _imported:
+        return
+    try:
+        from PIL import Image, features
+    except ImportError:
+        pass
+    try:
+        import fitz
+    except ImportError:
+        pass
+    _imported = True
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+PREVIEW_EXTENSIONS = IMAGE_EXTENSIONS | {'pdf'}
+
+
+def thumbnail_format(preferred='WEBP'):
+    import_renderers()
+    if preferred == 'WEBP' and Image is not None and not features.check('webp'):
+        return 'JPEG'
+    return preferred
+
+
+def thumbnail_path(path, fmt='WEBP'):
+    # thumbs/ab/cd/<sha256>.webp for ab/cd/<sha256>.pdf
+    stem = path.rsplit('.', 1)[0]
+    return f"thumbs/{stem}.{'jpg' if fmt == 'JPEG' else fmt.lower()}"
+
+
+def needs_thumbnail(path):
+    return path.rsplit('.', 1)[-1].lower() in PREVIEW_EXTENSIONS
+
+
+def render_pdf_first_page(source, dpi=72):
+    if fitz is not None:
+        with fitz.open(source) as pdf:
+            if not pdf.page_count:
+                return None
+            pixmap = pdf[0].get_pixmap(dpi=dpi)
+            return Image.open(io.BytesIO(pixmap.tobytes('png')))
+    if shutil.which('pdftoppm'):
+        with tempfile.TemporaryDirectory() as tmp:
+            prefix = os.path.join(tmp, 'page')
+            subprocess.run(['pdftoppm', '-png', '-singlefile', '-f', '1', '-l', '1', '-r', str(dpi),
+                            source, prefix], check=True, capture_output=True, timeout=60)
+            with Image.open(prefix + '.png') as image:
+                image.load()
+                return image
+    return None
+
+
+def generate_thumbnail(root, path, size=(320, 320), fmt='WEBP', quality=80):
+    # Writes the thumbnail for an upload next to the other thumbnails and
+    # returns its path relative to root, or None if it cannot be rendered.
+    import_renderers()
+    if Image is None or not needs_thumbnail(path):
+        return None
+    fmt = thumbnail_format(fmt)
+    target_rel = thumbnail_path(path, fmt)
+    target = os.path.join(root, *target_rel.split('/'))
+    if os.path.exists(target):
+        return target_rel
+    source = os.path.join(root, *path.split('/'))
+    if not os.path.exists(source):
+        return None
+
+    if path.rsplit('.', 1)[-1].lower() == 'pdf':
+        image = render_pdf_first_page(source)
+        if image is None:
+            return None
+    else:
+        image = Image.open(source)
+    with image:
+        image.thumbnail(size)
+        if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = target + '.tmp'
+        image.save(tmp, format=fmt, quality=quality)
+        os.replace(tmp, target)
+    return target_rel